@@ -1,36 +1,89 @@
-import pygame
 import sys
 import time
 import random
 import os
 import math
 import json
+import hashlib
+import struct
+import zlib
+import mmap
+import bisect
+import importlib.util
+import contextlib
+import queue
+import threading
+from collections import OrderedDict, deque, namedtuple
 
-# Initialize Pygame
-pygame.init()
-pygame.mixer.pre_init(44100, -16, 2, 512)  # Reduce audio latency
-pygame.mixer.init()
 
-# Get the user's screen resolution
-info = pygame.display.Info()
-user_screen_width = info.current_w
-user_screen_height = info.current_h
+def lazy_import(name):
+    """Import a module on first attribute access; None if it is not installed"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# pygame and numpy are only loaded once something actually uses them, so
+# importing this module for tooling or the high-score functions is cheap
+pygame = lazy_import("pygame")
+np = lazy_import("numpy")  # Sound synthesis falls back to silent buffers without it
+sqlite3 = lazy_import("sqlite3")
+
+# Headless mode (CI, benchmarks): use SDL's dummy video and audio drivers
+HEADLESS = os.environ.get("RHYTHM_GAME_HEADLESS", "0") not in ("", "0")
+
+# Audio settings, applied with pre_init() before pygame.init()
+MIXER_FREQUENCY = 44100
+MIXER_SIZE = -16
+MIXER_CHANNELS = 2
+MIXER_BUFFER = 512  # Small buffer to reduce audio latency
 
 # Constants - Base resolution for calculations
 BASE_WIDTH = 800
 BASE_HEIGHT = 600
 
-# Set the game resolution based on the user's screen
-# Use 80% of the screen size by default, but ensure minimum size
-SCREEN_WIDTH = max(800, int(user_screen_width * 0.8))
-SCREEN_HEIGHT = max(600, int(user_screen_height * 0.8))
+# The user's screen resolution and everything derived from it are filled in
+# by startup(); until then the module uses the base resolution so it can be
+# imported (tooling, tests, high scores) without touching pygame.
+user_screen_width = BASE_WIDTH
+user_screen_height = BASE_HEIGHT
+SCREEN_WIDTH = BASE_WIDTH
+SCREEN_HEIGHT = BASE_HEIGHT
 
 # Calculate scaling factors for responsive design
 SCALE_X = SCREEN_WIDTH / BASE_WIDTH
 SCALE_Y = SCREEN_HEIGHT / BASE_HEIGHT
 
 # Game settings
-FPS = 60
+FPS = 60  # Render rate; the simulation is driven by elapsed time, not frames
+MAX_FRAME_TIME = 0.25  # Longest step (seconds) simulated in one update after a hitch
+
+# Frame profiler: percentiles cover the last PROFILE_HISTORY frames and the
+# overlay text is refreshed every PROFILE_REFRESH seconds
+PROFILE_HISTORY = 600
+PROFILE_REFRESH = 0.5
+
+# Input sampling: while waiting for the next frame, key events are polled
+# (and timestamped) every INPUT_POLL_INTERVAL seconds
+INPUT_POLL_INTERVAL = 0.001
+
+# Music sync. Game time follows the backing track's playback position:
+# each new position reading pulls the clock towards it by SONG_DRIFT_GAIN,
+# and an error larger than SONG_RESYNC_THRESHOLD (seconds) snaps to it.
+SONG_DRIFT_GAIN = 0.1
+SONG_RESYNC_THRESHOLD = 0.1
+
+# Effect timing (seconds). Animal animations are authored in frames at
+# ANIMATION_RATE and played back at that rate regardless of the render FPS.
+EFFECT_LIFETIME = 50 / 60
+ANIMATION_RATE = 60
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 GRAY = (50, 50, 50)
@@ -42,53 +95,202 @@ PURPLE = (128, 0, 128)
 CYAN = (0, 255, 255)
 ORANGE = (255, 165, 0)
 
-# High scores file
+# High scores. Every run is kept in the SQLite database; the JSON file is
+# the old top-5 format, imported into the database once.
 HIGH_SCORES_FILE = "rhythm_game_scores.json"
+SCORES_DB_FILE = "rhythm_game_scores.db"
+SCORES_SCHEMA_VERSION = 1
+PLAYER_NAME = "PLAYER"
+LEADERBOARD_SIZE = 5  # Rows per difficulty on the results screen
+PERSIST_QUEUE_SIZE = 64  # Score writes waiting for the disk before save() blocks
+
+# Player settings. The offsets come from the calibration screen:
+# audio_offset_ms is how late sound is heard, input_offset_ms how late a
+# tap lands after what the player sees.
+SETTINGS_FILE = "rhythm_game_settings.json"
+DEFAULT_SETTINGS = {'audio_offset_ms': 0.0, 'input_offset_ms': 0.0}
+CALIBRATION_INTERVAL = 0.6  # Seconds between calibration beats
+CALIBRATION_BEATS = 16  # Beats per calibration round
+CALIBRATION_WARMUP = 4  # Leading beats whose taps are ignored while the player finds the rhythm
+
+# Chart files. Text charts have one note per line, in non-decreasing time order:
+#   <time_ms> <track> <normal|hold|special> [hold_ms]
+# Binary charts are a header followed by fixed-size little-endian records
+# (time_ms u32, track u8, note type index u8, hold_ms u16), sorted by time.
+# With CHART_FLAG_INDEX the records are followed by a u32 per second of
+# chart time: the number of records before that second, for seeking.
+CHART_MAGIC = b"RGCH"
+CHART_VERSION = 1
+CHART_HEADER = struct.Struct('<4sHHI')  # magic, version, flags, note count
+CHART_RECORD = struct.Struct('<IBBH')
+CHART_DTYPE = [('time_ms', '<u4'), ('track', 'u1'), ('note_type', 'u1'), ('hold_ms', '<u2')]  # Same layout as CHART_RECORD
+CHART_INDEX_ENTRY = struct.Struct('<I')
+CHART_FLAG_INDEX = 1
+CHART_CHUNK_RECORDS = 4096  # Records read from disk at a time when streaming
+
+# Replay files: a header (seed, resolution, chart and its SHA-1), the
+# recorded result and a zlib-compressed log of records in the order the
+# game processed them.
+# Record times are game time in whole microseconds, stored as the change
+# from the previous record; while recording the game runs on the same
+# rounded times, so a replay reproduces every judgment exactly.
+REPLAY_MAGIC = b"RGRP"
+REPLAY_VERSION = 3
+# magic, version, seed, width, height, chart start, start time (us), chart SHA-1, record count, chart path length
+REPLAY_HEADER = struct.Struct('<4sHQHHdq20sIH')
+REPLAY_RESULT = struct.Struct('<qIIII4s')  # score, max combo, perfect, good, misses, grade
+REPLAY_RECORD = struct.Struct('<Bii')  # kind, time delta (us) from the previous record or the start time, argument
+REPLAY_FRAME = 0  # Simulation step to this game time
+REPLAY_KEY = 1  # Gameplay key (argument: key code) pressed at this game time
+REPLAY_AUDIO_OFFSET = 2  # Calibrated offsets changed (argument: microseconds)
+REPLAY_INPUT_OFFSET = 3
+REPLAY_RESIZE = 4  # Window resized (argument: width << 16 | height)
+REPLAY_MAX_DIMENSION = 16384  # Largest window width or height a replay may claim
+
+# Synthesized sound bank cache (one .npz per mixer format / recipe hash)
+SOUND_CACHE_DIR = "rhythm_game_cache"
+SOUND_CACHE_VERSION = 2  # Bump when to_mixer_format output changes so stale banks are rebuilt
+SOUND_SAMPLE_RATE = 44100  # Rate the recipes are authored at; buffers are rendered at the mixer's rate
+
+# Sound effect voices. SoundPool plays effects on SOUND_VOICES mixer
+# channels; when all are busy a new sound takes over the oldest sound of the
+# lowest priority not above its own, or is dropped.
+SOUND_VOICES = 16
+SOUND_PRIORITIES = {
+    'game_over': 4,
+    'level_up': 3,
+    'combo': 2,
+    'perfect': 1, 'good': 1, 'miss': 1, 'tick': 1,
+    'bird': 0, 'frog': 0, 'rabbit': 0, 'cat': 0
+}
+
+# Sound effect recipes. Each segment is a decaying sine wave written at
+# `start` (offsets in samples at SOUND_SAMPLE_RATE):
+#   amp * sin(phase / period) * exp(-i / decay)
+# 'descending' runs the phase backwards from the end of the segment and
+# 'warble' = (period, gain) scales the first half of every period by gain.
+SOUND_RECIPES = {
+    'perfect': {  # Ascending happy tones
+        'volume': 0.4,
+        'segments': [
+            {'start': 0, 'length': 5000, 'amp': 32767, 'period': 10, 'decay': 4000},
+            {'start': 5000, 'length': 5000, 'amp': 32767, 'period': 8, 'decay': 4000},
+            {'start': 10000, 'length': 5000, 'amp': 32767, 'period': 6, 'decay': 4000}
+        ]
+    },
+    'good': {  # Medium tone
+        'volume': 0.3,
+        'segments': [
+            {'start': 0, 'length': 8000, 'amp': 32767, 'period': 12, 'decay': 4000}
+        ]
+    },
+    'miss': {  # Descending sad tones
+        'volume': 0.3,
+        'segments': [
+            {'start': 0, 'length': 10000, 'amp': 32767, 'period': 8, 'decay': 8000, 'descending': True}
+        ]
+    },
+    'level_up': {  # Triumphant fanfare
+        'volume': 0.5,
+        'segments': [
+            {'start': 0, 'length': 5000, 'amp': 20000, 'period': 4, 'decay': 10000},
+            {'start': 5000, 'length': 5000, 'amp': 20000, 'period': 3, 'decay': 10000},
+            {'start': 10000, 'length': 10000, 'amp': 20000, 'period': 2, 'decay': 10000}
+        ]
+    },
+    'combo': {  # Quick ascending notes
+        'volume': 0.4,
+        'segments': [
+            {'start': 0, 'length': 2000, 'amp': 20000, 'period': 10, 'decay': 2000},
+            {'start': 2000, 'length': 2000, 'amp': 20000, 'period': 8, 'decay': 2000},
+            {'start': 4000, 'length': 2000, 'amp': 20000, 'period': 6, 'decay': 2000}
+        ]
+    },
+    'game_over': {  # Dramatic descending tones with a pulse
+        'volume': 0.6,
+        'segments': [
+            {'start': 0, 'length': 20000, 'amp': 20000, 'period': 2, 'decay': 15000,
+             'descending': True, 'warble': (1000, 0.7)}
+        ]
+    },
+    'bird': {  # Chirp
+        'volume': 0.3,
+        'segments': [
+            {'start': 0, 'length': 1000, 'amp': 20000, 'period': 2, 'decay': 500},
+            {'start': 1500, 'length': 1000, 'amp': 20000, 'period': 1.5, 'decay': 500}
+        ]
+    },
+    'frog': {  # Ribbit
+        'volume': 0.3,
+        'segments': [
+            {'start': 0, 'length': 3000, 'amp': 20000, 'period': 20, 'decay': 2000, 'warble': (200, 0.7)}
+        ]
+    },
+    'rabbit': {  # Hop
+        'volume': 0.3,
+        'segments': [
+            {'start': 0, 'length': 1000, 'amp': 10000, 'period': 8, 'decay': 500}
+        ]
+    },
+    'cat': {  # Meow
+        'volume': 0.3,
+        'segments': [
+            {'start': 0, 'length': 5000, 'amp': 15000, 'period': 15, 'decay': 4000,
+             'descending': True, 'warble': (500, 1.2)}
+        ]
+    },
+    'tick': {  # Metronome click for calibration
+        'volume': 0.6,
+        'segments': [
+            {'start': 0, 'length': 1200, 'amp': 24000, 'period': 1.2, 'decay': 300}
+        ]
+    }
+}
 
 # Game settings
 DIFFICULTY_SETTINGS = {
     'easy': {
-        'note_speed': 3 * SCALE_Y,
+        'note_speed': 180,  # Pixels per second at the base resolution (scaled by SCALE_Y)
         'spawn_rate_min': 1.0,
         'spawn_rate_max': 2.0,
-        'perfect_threshold': 20 * SCALE_Y,
-        'good_threshold': 40 * SCALE_Y,
+        'perfect_window_ms': 111,  # Max |press - hit time| for a perfect hit
+        'good_window_ms': 222,
         'notes_to_pass': 50,  # Number of notes to hit to pass this level
         'accuracy_to_pass': 70  # Minimum accuracy percentage to pass
     },
     'normal': {
-        'note_speed': 5 * SCALE_Y,
+        'note_speed': 300,
         'spawn_rate_min': 0.5,
         'spawn_rate_max': 1.5,
-        'perfect_threshold': 15 * SCALE_Y,
-        'good_threshold': 30 * SCALE_Y,
+        'perfect_window_ms': 50,
+        'good_window_ms': 100,
         'notes_to_pass': 100,
         'accuracy_to_pass': 75
     },
     'hard': {
-        'note_speed': 7 * SCALE_Y,
+        'note_speed': 420,
         'spawn_rate_min': 0.3,
         'spawn_rate_max': 1.0,
-        'perfect_threshold': 10 * SCALE_Y,
-        'good_threshold': 20 * SCALE_Y,
+        'perfect_window_ms': 24,
+        'good_window_ms': 48,
         'notes_to_pass': 150,
         'accuracy_to_pass': 80
     },
     'expert': {
-        'note_speed': 9 * SCALE_Y,
+        'note_speed': 540,
         'spawn_rate_min': 0.2,
         'spawn_rate_max': 0.8,
-        'perfect_threshold': 8 * SCALE_Y,
-        'good_threshold': 15 * SCALE_Y,
+        'perfect_window_ms': 15,
+        'good_window_ms': 28,
         'notes_to_pass': 200,
         'accuracy_to_pass': 85
     },
     'master': {
-        'note_speed': 12 * SCALE_Y,
+        'note_speed': 720,
         'spawn_rate_min': 0.1,
         'spawn_rate_max': 0.5,
-        'perfect_threshold': 5 * SCALE_Y,
-        'good_threshold': 10 * SCALE_Y,
+        'perfect_window_ms': 7,
+        'good_window_ms': 14,
         'notes_to_pass': 300,
         'accuracy_to_pass': 90
     }
@@ -111,18 +313,362 @@ LEVEL_THRESHOLDS = [
     45000   # Level 10
 ]
 
-NOTE_SPEED = 5 * SCALE_Y  # Default speed at which notes fall
+NOTE_SPEED = 300 * SCALE_Y  # Default speed at which notes fall (pixels per second)
 TRACK_COUNT = 4  # Number of tracks/lanes
+NOTE_TYPES = ("normal", "hold", "special")
 TRACK_WIDTH = SCREEN_WIDTH // (TRACK_COUNT + 1)
 TARGET_Y = SCREEN_HEIGHT - int(100 * SCALE_Y)  # Y position of the target line
-PERFECT_THRESHOLD = 15 * SCALE_Y  # Default timing threshold for perfect hit
-GOOD_THRESHOLD = 30 * SCALE_Y     # Default timing threshold for good hit
+PERFECT_WINDOW_MS = 50  # Default timing window for perfect hit (milliseconds)
+GOOD_WINDOW_MS = 100    # Default timing window for good hit (milliseconds)
+
+# Startup phase timings in milliseconds, filled in by startup() and RhythmGame()
+STARTUP_TIMINGS = OrderedDict()
+_started = False
+_startup_logged = False
+
+
+def configure_resolution(width, height):
+    """Set the window size and recompute every resolution-dependent global"""
+    global SCREEN_WIDTH, SCREEN_HEIGHT, SCALE_X, SCALE_Y, TRACK_WIDTH, TARGET_Y, NOTE_SPEED
+    SCREEN_WIDTH = width
+    SCREEN_HEIGHT = height
+    SCALE_X = SCREEN_WIDTH / BASE_WIDTH
+    SCALE_Y = SCREEN_HEIGHT / BASE_HEIGHT
+    TRACK_WIDTH = SCREEN_WIDTH // (TRACK_COUNT + 1)
+    TARGET_Y = SCREEN_HEIGHT - int(100 * SCALE_Y)
+    NOTE_SPEED = DIFFICULTY_SETTINGS['normal']['note_speed'] * SCALE_Y
+
+
+def record_phase(name, start):
+    STARTUP_TIMINGS[name] = (time.perf_counter() - start) * 1000
+
+
+def startup(headless=None):
+    """Initialize pygame, the mixer and the resolution globals (once)"""
+    global _started, HEADLESS, user_screen_width, user_screen_height
+    if _started:
+        return
+    _started = True
+    
+    if headless is not None:
+        HEADLESS = headless
+    if HEADLESS:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    
+    # pre_init must come before init for the low-latency buffer to take effect
+    start = time.perf_counter()
+    pygame.mixer.pre_init(MIXER_FREQUENCY, MIXER_SIZE, MIXER_CHANNELS, MIXER_BUFFER)
+    pygame.init()
+    record_phase('pygame_init', start)
+    
+    start = time.perf_counter()
+    if not pygame.mixer.get_init():
+        try:
+            pygame.mixer.init()
+        except pygame.error as e:
+            print(f"Could not initialize audio: {e}")
+    record_phase('mixer_init', start)
+    
+    # Get the user's screen resolution
+    start = time.perf_counter()
+    info = pygame.display.Info()
+    user_screen_width = info.current_w
+    user_screen_height = info.current_h
+    
+    # Set the game resolution based on the user's screen
+    # Use 80% of the screen size by default, but ensure minimum size
+    configure_resolution(max(800, int(user_screen_width * 0.8)), max(600, int(user_screen_height * 0.8)))
+    record_phase('display_query', start)
+
+
+def log_startup_timings():
+    # Only the first game's startup is worth reporting; later games reuse pygame
+    global _startup_logged
+    if _startup_logged:
+        return
+    _startup_logged = True
+    total = sum(STARTUP_TIMINGS.values())
+    phases = ", ".join(f"{name} {ms:.1f} ms" for name, ms in STARTUP_TIMINGS.items())
+    print(f"Startup: {total:.1f} ms ({phases})")
+
+
+class TextCache:
+    # LRU cache for fonts and rendered text surfaces.
+    # Fonts are keyed by (font spec, size) and surfaces by
+    # (font spec, size, text, color, antialias). Surfaces handed out by
+    # render() are shared, so callers must not modify them (copy first).
+    def __init__(self, max_fonts=64, max_surfaces=512):
+        self.max_fonts = max_fonts
+        self.max_surfaces = max_surfaces
+        self.fonts = OrderedDict()
+        self.surfaces = OrderedDict()
+        self.font_hits = 0
+        self.font_misses = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_font(self, size, name=None):
+        key = (name, size)
+        font = self.fonts.get(key)
+        if font is not None:
+            self.fonts.move_to_end(key)
+            self.font_hits += 1
+            return font
+
+        self.font_misses += 1
+        font = pygame.font.SysFont(name, size)
+        self.fonts[key] = font
+        if len(self.fonts) > self.max_fonts:
+            self.fonts.popitem(last=False)
+        return font
+
+    def render(self, text, size, color, name=None, antialias=True):
+        key = (name, size, text, tuple(color), antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = self.get_font(size, name).render(text, antialias, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_surfaces:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        # Called on window resize: every cached size is now stale
+        self.fonts.clear()
+        self.surfaces.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'font_hits': self.font_hits,
+            'font_misses': self.font_misses,
+            'cached_fonts': len(self.fonts),
+            'cached_surfaces': len(self.surfaces)
+        }
+
+
+def synthesize_sound(recipe, frequency=SOUND_SAMPLE_RATE):
+    """Render a sound recipe into a mono int16 buffer at `frequency`, ending with its last segment"""
+    # The segments are closed-form, so other rates are rendered by sampling
+    # them at fractional recipe offsets rather than by resampling
+    scale = SOUND_SAMPLE_RATE / frequency
+    end = max(segment['start'] + segment['length'] for segment in recipe['segments'])
+    buffer = np.zeros((math.ceil(end / scale),), dtype=np.int16)
+    for segment in recipe['segments']:
+        first = math.ceil(segment['start'] / scale)
+        last = math.ceil((segment['start'] + segment['length']) / scale)
+        i = np.arange(first, last, dtype=np.float64) * scale - segment['start']
+        phase = segment['length'] - i if segment.get('descending') else i
+        wave = np.trunc(segment['amp'] * np.sin(phase / segment['period']) * np.exp(-i / segment['decay']))
+        if 'warble' in segment:
+            period, gain = segment['warble']
+            warble = i % period < period / 2
+            wave[warble] = np.trunc(wave[warble] * gain)
+        buffer[first:last] = wave.astype(np.int16)
+    return buffer
+
+
+def to_mixer_format(samples, mixer):
+    """Convert mono int16 samples to the mixer.get_init() layout (8/16-bit int or -32 float32 samples)"""
+    _, size, channels = mixer
+    if size == -16:
+        data = samples
+    elif size == 16:
+        data = (samples.astype(np.int32) + 32768).astype(np.uint16)
+    elif size == -8:
+        data = (samples >> 8).astype(np.int8)
+    elif size == 8:
+        data = ((samples >> 8) + 128).astype(np.uint8)
+    elif size == -32:
+        # SDL's 32-bit mixer is float32 in [-1, 1]; get_init() never reports +32
+        data = samples.astype(np.float32) / 32768
+    else:
+        raise ValueError(f"Unsupported mixer sample size {size}")
+    # Interleave one copy per output channel
+    return np.ascontiguousarray(np.repeat(data[:, np.newaxis], channels, axis=1))
+
+
+def sound_bank_footprint(sounds):
+    """Bytes of PCM held by each loaded Sound"""
+    return {name: memoryview(sound).nbytes for name, sound in sounds.items()}
+
+
+def sound_bank_key():
+    """Hash of the cache version, mixer format and sound recipes"""
+    spec = {
+        'version': SOUND_CACHE_VERSION,
+        'mixer': pygame.mixer.get_init(),
+        'sample_rate': SOUND_SAMPLE_RATE,
+        'recipes': SOUND_RECIPES
+    }
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_sound_bank():
+    """Load synthesized PCM buffers in the mixer's format from the disk cache, synthesizing on a miss"""
+    key = sound_bank_key()
+    path = os.path.join(SOUND_CACHE_DIR, f"sounds_{key[:16]}.npz")
+    try:
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if str(data['key']) == key:
+                    return {name: data[name] for name in SOUND_RECIPES}
+    except Exception as e:
+        print(f"Error loading sound cache: {e}")
+
+    mixer = pygame.mixer.get_init()
+    bank = {name: to_mixer_format(synthesize_sound(recipe, mixer[0]), mixer) for name, recipe in SOUND_RECIPES.items()}
+
+    # Write to a temporary file first so a crash never leaves a torn cache
+    try:
+        os.makedirs(SOUND_CACHE_DIR, exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, key=np.array(key), **bank)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Error saving sound cache: {e}")
+    return bank
+
+
+class SoundPool:
+    # Plays sound effects on a fixed set of mixer channels, stealing the
+    # oldest low-priority voice when they are all busy
+    def __init__(self, sounds, voices=SOUND_VOICES):
+        self.sounds = sounds
+        if not pygame.mixer.get_init():
+            voices = 0  # No audio device: every play is a no-op
+        else:
+            pygame.mixer.set_num_channels(voices)
+        self.channels = [pygame.mixer.Channel(i) for i in range(voices)]
+        self.voices = [(0, 0)] * voices  # (priority, start order) of what each channel plays
+        self.order = 0
+        self.played = 0
+        self.stolen = 0
+        self.dropped = 0
+    
+    def play(self, name):
+        sound = self.sounds.get(name)
+        if sound is None or not self.channels:
+            return None
+        priority = SOUND_PRIORITIES.get(name, 0)
+        
+        index = next((i for i, channel in enumerate(self.channels) if not channel.get_busy()), None)
+        if index is None:
+            # Lowest priority first, then the oldest
+            index = min(range(len(self.channels)), key=lambda i: self.voices[i])
+            if self.voices[index][0] > priority:
+                self.dropped += 1
+                return None
+            self.stolen += 1
+        
+        self.order += 1
+        self.voices[index] = (priority, self.order)
+        self.played += 1
+        channel = self.channels[index]
+        channel.play(sound)
+        return channel
+    
+    def stats(self):
+        return {'played': self.played, 'stolen': self.stolen, 'dropped': self.dropped, 'voices': len(self.channels)}
+
+
+# Shared text cache used by notes, effects and the HUD
+text_cache = TextCache()
+
+
+class EffectSpriteBank:
+    # Pre-rendered fade/pulse frames for HitEffect and ComboEffect.
+    # Each (text, size, color) is baked into a small set of quantized alpha
+    # frames (and alpha x scale frames for pulsing text), so drawing a live
+    # effect is a single blit. Frames are baked the first time they are used.
+    def __init__(self, alpha_steps=16, scale_steps=9, min_scale=0.8, max_scale=1.2, max_entries=64):
+        self.alpha_steps = alpha_steps
+        self.scale_steps = scale_steps
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.frames_baked = 0
+
+    def _entry(self, text, size, color):
+        key = (text, size, tuple(color))
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = {
+                'base': text_cache.render(text, size, color),
+                'fade': [None] * self.alpha_steps,
+                'pulse': [[None] * self.alpha_steps for _ in range(self.scale_steps)]
+            }
+            self.entries[key] = entry
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return entry
+
+    def _alpha_index(self, alpha):
+        alpha = min(1.0, max(0.0, alpha))
+        return int(round(alpha * (self.alpha_steps - 1)))
+
+    def _scale_index(self, scale):
+        t = (scale - self.min_scale) / (self.max_scale - self.min_scale)
+        return int(round(min(1.0, max(0.0, t)) * (self.scale_steps - 1)))
+
+    def _apply_alpha(self, frame, alpha_index):
+        # Bake the fade into per-pixel alpha so no surface alpha is needed at draw time
+        alpha = int(255 * alpha_index / (self.alpha_steps - 1))
+        frame.fill((255, 255, 255, alpha), special_flags=pygame.BLEND_RGBA_MULT)
+        self.frames_baked += 1
+        return frame
+
+    def fade(self, text, size, color, alpha):
+        entry = self._entry(text, size, color)
+        alpha_index = self._alpha_index(alpha)
+        frame = entry['fade'][alpha_index]
+        if frame is None:
+            frame = self._apply_alpha(entry['base'].copy(), alpha_index)
+            entry['fade'][alpha_index] = frame
+        return frame
+
+    def pulse(self, text, size, color, scale, alpha):
+        entry = self._entry(text, size, color)
+        scale_index = self._scale_index(scale)
+        alpha_index = self._alpha_index(alpha)
+        frame = entry['pulse'][scale_index][alpha_index]
+        if frame is None:
+            base = entry['base']
+            scale = self.min_scale + (self.max_scale - self.min_scale) * scale_index / (self.scale_steps - 1)
+            frame = pygame.transform.scale(
+                base, (max(1, int(base.get_width() * scale)), max(1, int(base.get_height() * scale))))
+            frame = self._apply_alpha(frame, alpha_index)
+            entry['pulse'][scale_index][alpha_index] = frame
+        return frame
+
+    def clear(self):
+        self.entries.clear()
+
+
+# Shared baked sprites for hit and combo popups
+effect_sprites = EffectSpriteBank()
+
+
 class AnimalAnimation:
     def __init__(self, x, y, track):
         self.x = x
         self.y = y
         self.track = track
-        self.lifetime = 1.0  # Animation duration in seconds
+        self.duration = EFFECT_LIFETIME
+        self.lifetime = self.duration  # Remaining animation time in seconds
         self.scale = 1.0
         self.rotation = 0
         
@@ -130,41 +676,49 @@ class AnimalAnimation:
         self.animal_type = ["bird", "frog", "rabbit", "cat"][track]
         self.color = [RED, GREEN, BLUE, YELLOW][track]
         
-        # Animation properties
+        # Animation properties (frames counts ANIMATION_RATE ticks, fractional)
         self.frames = 0
         self.max_frames = 20
         self.jump_height = 0
         
-    def update(self):
-        self.lifetime -= 0.02
-        self.frames += 1
+    def update(self, dt):
+        self.lifetime -= dt
+        self.frames += dt * ANIMATION_RATE
+        steps = dt * ANIMATION_RATE  # Movement below is authored per animation frame
         
         # Different animation for each animal
         if self.animal_type == "bird":
             # Bird flies up in an arc
-            self.y -= 3 * SCALE_Y
-            self.x += math.sin(self.frames / 5) * 3 * SCALE_X
+            self.y -= 3 * SCALE_Y * steps
+            self.x += math.sin(self.frames / 5) * 3 * SCALE_X * steps
             self.rotation = math.sin(self.frames / 3) * 15
         elif self.animal_type == "frog":
             # Frog jumps up and down
             self.jump_height = math.sin(self.frames / 10) * 30 * SCALE_Y
             if self.frames > self.max_frames / 2:
-                self.y -= 1 * SCALE_Y  # Gradually move up
+                self.y -= 1 * SCALE_Y * steps  # Gradually move up
         elif self.animal_type == "rabbit":
             # Rabbit hops to the right
-            self.x += 2 * SCALE_X
+            self.x += 2 * SCALE_X * steps
             self.jump_height = abs(math.sin(self.frames / 5) * 20 * SCALE_Y)
         elif self.animal_type == "cat":
             # Cat pounces to the left
-            self.x -= 2 * SCALE_X
+            self.x -= 2 * SCALE_X * steps
             self.jump_height = abs(math.sin(self.frames / 5) * 15 * SCALE_Y)
             
         # Scale down slightly as animation progresses
-        self.scale = 1.0 - (0.3 * (1.0 - self.lifetime))
+        self.scale = 1.0 - (0.3 * (1.0 - self.lifetime / self.duration))
         
         return self.lifetime > 0
         
     def draw(self, screen):
+        # Play back the pre-rendered frame for this point of the animation
+        frame, (offset_x, offset_y) = animal_frames.get(self.animal_type, int(self.frames))
+        return screen.blit(frame, (int(self.x) - offset_x, int(self.y - self.jump_height) - offset_y))
+    
+    def rasterize(self, screen):
+        # Draw the animal at (self.x, self.y - self.jump_height) with the current
+        # scale, rotation and frame. Used to bake AnimalFrameBank frames.
         # Base size for animal shapes
         size = 30 * SCALE_Y * self.scale
         
@@ -206,7 +760,7 @@ class AnimalAnimation:
             pygame.draw.circle(screen, self.color, body_pos, size/1.5)
             
             # Draw legs
-            leg_spread = self.frames % 10 < 5  # Alternate leg positions
+            leg_spread = int(self.frames) % 10 < 5  # Alternate leg positions
             leg_width = size/4
             
             if leg_spread:
@@ -295,7 +849,7 @@ class AnimalAnimation:
             
             # Draw eyes
             eye_spacing = size/2
-            eye_shape = self.frames % 20 < 10  # Blink animation
+            eye_shape = int(self.frames) % 20 < 10  # Blink animation
             
             if eye_shape:
                 # Open eyes
@@ -352,12 +906,72 @@ class AnimalAnimation:
             pygame.draw.line(screen, WHITE, 
                            (self.x + size/6, whisker_y), 
                            (self.x + whisker_length, whisker_y + size/6), 1)
+class AnimalFrameBank:
+    # Pre-rendered frame sequences for the four animal animations. The shape
+    # of an animation is a deterministic function of its frame counter, so
+    # every frame (with rotation and scale applied) is baked once per window
+    # size and played back as a blit. If the full set would exceed
+    # memory_budget bytes, only every n-th frame is baked.
+    ANIMALS = ["bird", "frog", "rabbit", "cat"]
+    
+    def __init__(self, memory_budget=16 * 1024 * 1024):
+        self.memory_budget = memory_budget
+        self.frames = {}
+        self.stride = 1
+        self.frame_bytes = 0
+        self.cell = 0
+    
+    def build(self):
+        frame_count = int(EFFECT_LIFETIME * ANIMATION_RATE) + 1
+        # Large enough for the widest pose (wings, whiskers, ears) at full scale
+        self.cell = int(2 * 1.4 * 30 * SCALE_Y) + 4
+        bytes_per_frame = self.cell * self.cell * 4
+        total = bytes_per_frame * frame_count * len(self.ANIMALS)
+        self.stride = max(1, math.ceil(total / self.memory_budget))
+        
+        center = self.cell // 2
+        self.frames = {}
+        for track, animal_type in enumerate(self.ANIMALS):
+            template = AnimalAnimation(center, center, track)
+            sequence = []
+            for index in range(0, frame_count, self.stride):
+                # Mirror the state AnimalAnimation.update() produces at this frame
+                template.frames = index
+                template.scale = 1.0 - 0.3 * min(1.0, index / (EFFECT_LIFETIME * ANIMATION_RATE))
+                template.rotation = math.sin(index / 3) * 15 if animal_type == "bird" else 0
+                surface = pygame.Surface((self.cell, self.cell), pygame.SRCALPHA)
+                surface.fill((0, 0, 0, 0))
+                template.rasterize(surface)
+                sequence.append(surface.convert_alpha())
+            self.frames[animal_type] = sequence
+        self.frame_bytes = bytes_per_frame * sum(len(sequence) for sequence in self.frames.values())
+    
+    def get(self, animal_type, frame):
+        # Returns the baked surface and the offset of the animal's anchor in it
+        if not self.frames:
+            self.build()
+        sequence = self.frames[animal_type]
+        index = min(max(0, frame) // self.stride, len(sequence) - 1)
+        return sequence[index], (self.cell // 2, self.cell // 2)
+    
+    def clear(self):
+        self.frames = {}
+        self.frame_bytes = 0
+
+
+# Shared baked animal animations
+animal_frames = AnimalFrameBank()
+
+
 class Note:
-    def __init__(self, track, speed=NOTE_SPEED, note_type="normal"):
+    def __init__(self, track, speed=None, note_type="normal", spawn_time=0.0):
         self.track = track  # Which track/lane the note is in (0-3)
         self.x = (track + 1) * TRACK_WIDTH - TRACK_WIDTH // 2
         self.y = 0
-        self.speed = speed
+        self.speed = speed if speed is not None else NOTE_SPEED  # Pixels per second
+        self.spawn_time = spawn_time  # Game time (seconds) at which the note entered at y = 0
+        self.hold_duration = 0.0  # Seconds, for hold notes from a chart
+        self.hit_time = spawn_time + TARGET_Y / self.speed  # Game time at which it reaches the target line
         self.width = int(50 * SCALE_X)
         self.height = int(20 * SCALE_Y)
         self.active = True
@@ -375,14 +989,15 @@ class Note:
             self.color = CYAN
             self.height = int(60 * SCALE_Y)
     
-    def update(self):
-        self.y += self.speed
-        # Check if note has passed the target area without being hit
-        if self.y > TARGET_Y + GOOD_THRESHOLD and not self.hit:
-            self.missed = True
-            self.active = False
+    def update(self, now):
+        # Position is a function of game time, so it is independent of the frame rate.
+        # It is anchored on the hit time so the note still lands on the target after a resize.
+        # Misses are decided by the note store's expire(), at judgment time.
+        self.y = TARGET_Y - (self.hit_time - now) * self.speed
     
-    def draw(self, screen):
+    def rasterize(self, screen):
+        # Draw the note shape centred on (self.x, self.y). Only used to build
+        # the note atlas; gameplay draws notes as atlas blits.
         if self.active:
             if self.note_type == "normal":
                 # Draw note with 3D effect
@@ -506,17 +1121,444 @@ class Note:
                     ])
                 
                 # Add "HOLD" text below the arrow
-                hold_font = pygame.font.SysFont(None, int(18 * SCALE_Y))
-                hold_surf = hold_font.render("HOLD", True, BLACK)
+                hold_surf = text_cache.render("HOLD", int(18 * SCALE_Y), BLACK)
                 hold_rect = hold_surf.get_rect(center=(self.x, self.y + int(15 * SCALE_Y)))
                 screen.blit(hold_surf, hold_rect)
+class NoteAtlas:
+    # Every (track, note_type) sprite rasterized once at the current scale
+    # into one shared surface, so all notes are drawn with a single
+    # Surface.blits() call. Cleared on resize and rebuilt on next use.
+    def __init__(self):
+        self.surface = None
+        self.areas = {}
+        self.offsets = (0, 0)
+    
+    def build(self):
+        # Cells are large enough for the tallest note (hold) plus outlines
+        cell_w = int(64 * SCALE_X) + 8
+        cell_h = int(64 * SCALE_Y) + 8
+        self.surface = pygame.Surface((cell_w * TRACK_COUNT, cell_h * len(NOTE_TYPES)), pygame.SRCALPHA)
+        self.surface.fill((0, 0, 0, 0))
+        for row, note_type in enumerate(NOTE_TYPES):
+            for track in range(TRACK_COUNT):
+                template = Note(track, NOTE_SPEED, note_type)
+                template.x = track * cell_w + cell_w // 2
+                template.y = row * cell_h + cell_h // 2
+                template.rasterize(self.surface)
+                self.areas[(track, note_type)] = pygame.Rect(track * cell_w, row * cell_h, cell_w, cell_h)
+        self.offsets = (cell_w // 2, cell_h // 2)
+    
+    def draw(self, screen, items, doreturn=False):
+        # items: iterable of (track, note_type, y). Returns the drawn rects if doreturn.
+        if self.surface is None:
+            self.build()
+        offset_x, offset_y = self.offsets
+        surface = self.surface
+        areas = self.areas
+        centers = [(track + 1) * TRACK_WIDTH - TRACK_WIDTH // 2 - offset_x for track in range(TRACK_COUNT)]
+        return screen.blits([(surface, (centers[track], int(y) - offset_y), areas[(track, note_type)])
+                             for track, note_type, y in items], doreturn=doreturn)
+    
+    def clear(self):
+        self.surface = None
+        self.areas = {}
+
+
+# Shared note sprite atlas
+note_atlas = NoteAtlas()
+
+
+class NoteLanes:
+    # Lane-indexed note store: one deque per track, ordered by hit time.
+    # The head of each lane is the next judgeable note, so finding the note
+    # to judge and expiring missed notes only ever touch the front of a lane.
+    def __init__(self, track_count=TRACK_COUNT):
+        self.lanes = [deque() for _ in range(track_count)]
+    
+    def spawn(self, track, speed, note_type, spawn_time, hold=0.0):
+        note = Note(track, speed, note_type, spawn_time)
+        note.hold_duration = hold
+        self.add(note)
+        return note
+    
+    def add(self, note):
+        lane = self.lanes[note.track]
+        # Notes almost always arrive in hit-time order; only a speed change
+        # can make a newer note land before an older one
+        index = len(lane)
+        while index > 0 and lane[index - 1].hit_time > note.hit_time:
+            index -= 1
+        if index == len(lane):
+            lane.append(note)
+        else:
+            lane.insert(index, note)
+    
+    def nearest(self, track, when):
+        # Distance to `when` is unimodal along a sorted lane, so stop as soon
+        # as it starts growing again
+        closest = None
+        min_distance = float('inf')
+        for note in self.lanes[track]:
+            distance = abs(when - note.hit_time)
+            if distance >= min_distance:
+                break
+            closest = note
+            min_distance = distance
+        return closest
+    
+    def remove(self, note):
+        lane = self.lanes[note.track]
+        if lane and lane[0] is note:
+            lane.popleft()
+        else:
+            lane.remove(note)
+    
+    def expire(self, now, good_window):
+        # Pop every note whose good window has passed; they form a prefix of each lane.
+        # Returns the number of missed notes.
+        missed = 0
+        for lane in self.lanes:
+            while lane and lane[0].hit_time + good_window < now:
+                note = lane.popleft()
+                note.missed = True
+                note.active = False
+                missed += 1
+        return missed
+    
+    def update(self, now, good_window):
+        for lane in self.lanes:
+            for note in lane:
+                note.update(now)
+    
+    def draw_items(self):
+        # (track, note_type, y) for every note, as consumed by NoteAtlas.draw
+        return [(note.track, note.note_type, note.y) for lane in self.lanes for note in lane]
+    
+    def clear(self):
+        for lane in self.lanes:
+            lane.clear()
+    
+    def __iter__(self):
+        for lane in self.lanes:
+            yield from lane
+    
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes)
+
+
+class NoteArrayEngine:
+    # Struct-of-arrays note store for very dense charts. Track, type, timing,
+    # position and state live in preallocated NumPy arrays (live notes packed
+    # in [0, count)), and movement, miss detection and culling are batched
+    # array operations. It has the same interface as NoteLanes; nearest()
+    # and iteration hand out Note objects materialized from the arrays.
+    FIELDS = {
+        'track': 'int8',
+        'note_type': 'int8',
+        'spawn_time': 'float64',
+        'hit_time': 'float64',
+        'speed': 'float64',
+        'y': 'float64',
+        'hold': 'float64',
+        'active': 'bool'
+    }
+    
+    def __init__(self, track_count=TRACK_COUNT, capacity=1024):
+        if np is None:
+            raise ImportError("numpy is required for the array note engine")
+        self.track_count = track_count
+        self.count = 0
+        self.capacity = capacity
+        for name, dtype in self.FIELDS.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+    
+    def _grow(self):
+        self.capacity *= 2
+        for name, dtype in self.FIELDS.items():
+            array = np.zeros(self.capacity, dtype=dtype)
+            array[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, array)
+    
+    def spawn(self, track, speed, note_type, spawn_time, hold=0.0):
+        if self.count == self.capacity:
+            self._grow()
+        # Slots are unordered; nearest() searches by time, not by position
+        i = self.count
+        self.track[i] = track
+        self.note_type[i] = NOTE_TYPES.index(note_type)
+        self.spawn_time[i] = spawn_time
+        self.hit_time[i] = spawn_time + TARGET_Y / speed
+        self.speed[i] = speed
+        self.y[i] = 0
+        self.hold[i] = hold
+        self.active[i] = True
+        self.count += 1
+        return self._materialize(i)
+    
+    def _materialize(self, i):
+        note = Note(int(self.track[i]), float(self.speed[i]),
+                    NOTE_TYPES[self.note_type[i]], float(self.spawn_time[i]))
+        note.hit_time = float(self.hit_time[i])
+        note.y = float(self.y[i])
+        note.hold_duration = float(self.hold[i])
+        note.slot = i
+        return note
+    
+    def nearest(self, track, when):
+        n = self.count
+        candidates = np.nonzero((self.track[:n] == track) & self.active[:n])[0]
+        if len(candidates) == 0:
+            return None
+        best = candidates[np.argmin(np.abs(self.hit_time[candidates] - when))]
+        return self._materialize(best)
+    
+    def remove(self, note):
+        # Deactivate now; the slot is reclaimed by the next cull
+        self.active[note.slot] = False
+    
+    def expire(self, now, good_window):
+        n = self.count
+        missed = self.active[:n] & (self.hit_time[:n] + good_window < now)
+        missed_count = int(np.count_nonzero(missed))
+        self.active[:n] &= ~missed
+        self._cull()
+        return missed_count
+    
+    def _cull(self):
+        n = self.count
+        keep = self.active[:n]
+        kept = int(np.count_nonzero(keep))
+        if kept == n:
+            return
+        for name in self.FIELDS:
+            array = getattr(self, name)
+            array[:kept] = array[:n][keep]
+        self.count = kept
+    
+    def update(self, now, good_window):
+        n = self.count
+        np.subtract(self.hit_time[:n], now, out=self.y[:n])
+        self.y[:n] *= -self.speed[:n]
+        self.y[:n] += TARGET_Y
+    
+    def draw_items(self):
+        n = self.count
+        active = self.active[:n]
+        return [(track, NOTE_TYPES[note_type], y) for track, note_type, y in zip(
+            self.track[:n][active].tolist(), self.note_type[:n][active].tolist(), self.y[:n][active].tolist())]
+    
+    def clear(self):
+        self.count = 0
+    
+    def __iter__(self):
+        for i in range(self.count):
+            if self.active[i]:
+                yield self._materialize(i)
+    
+    def __len__(self):
+        return int(np.count_nonzero(self.active[:self.count]))
+
+
+# Note stores selectable with RhythmGame(note_engine=...)
+NOTE_ENGINES = {
+    'lanes': NoteLanes,
+    'array': NoteArrayEngine
+}
+
+
+# One chart entry; time and hold are in seconds, time is when the note should be hit
+ChartNote = namedtuple('ChartNote', ['time', 'track', 'note_type', 'hold'])
+
+
+def iter_text_chart(path):
+    """Stream notes from a text chart"""
+    last_ms = None
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            fields = line.split()
+            try:
+                time_ms, track, note_type = int(fields[0]), int(fields[1]), fields[2]
+                hold_ms = int(fields[3]) if len(fields) > 3 else 0
+            except (IndexError, ValueError):
+                raise ValueError(f"{path}:{line_number}: expected '<time_ms> <track> <type> [hold_ms]'")
+            if not 0 <= track < TRACK_COUNT or note_type not in NOTE_TYPES:
+                raise ValueError(f"{path}:{line_number}: invalid track or note type")
+            # Notes are streamed just ahead of the playhead, so an earlier note can't come later
+            if last_ms is not None and time_ms < last_ms:
+                raise ValueError(f"{path}:{line_number}: time {time_ms} ms is before the previous note ({last_ms} ms)")
+            last_ms = time_ms
+            yield ChartNote(time_ms / 1000, track, note_type, hold_ms / 1000)
+
+
+def check_chart_record(path, index, time_ms, track, note_type, last_ms):
+    """Raise ValueError for a binary chart record with a bad track or note type, or out of time order"""
+    if track >= TRACK_COUNT or note_type >= len(NOTE_TYPES):
+        raise ValueError(f"{path}: record {index}: invalid track or note type")
+    if time_ms < last_ms:
+        raise ValueError(f"{path}: record {index}: time {time_ms} ms is before the previous note ({last_ms} ms)")
+
+
+def iter_binary_chart(path):
+    """Stream notes from a binary chart, reading fixed-size records in chunks (no NumPy needed)"""
+    with open(path, 'rb') as f:
+        magic, version, _, count = CHART_HEADER.unpack(f.read(CHART_HEADER.size))
+        if magic != CHART_MAGIC or version > CHART_VERSION:
+            raise ValueError(f"{path}: not a supported binary chart")
+        remaining = count
+        last_ms = 0
+        while remaining > 0:
+            chunk = f.read(min(remaining, CHART_CHUNK_RECORDS) * CHART_RECORD.size)
+            if not chunk or len(chunk) % CHART_RECORD.size:
+                raise ValueError(f"{path}: truncated chart")
+            for offset, (time_ms, track, note_type, hold_ms) in enumerate(CHART_RECORD.iter_unpack(chunk)):
+                if track >= TRACK_COUNT or note_type >= len(NOTE_TYPES) or time_ms < last_ms:
+                    check_chart_record(path, count - remaining + offset, time_ms, track, note_type, last_ms)
+                last_ms = time_ms
+                yield ChartNote(time_ms / 1000, track, NOTE_TYPES[note_type], hold_ms / 1000)
+            remaining -= len(chunk) // CHART_RECORD.size
+
+
+class MappedChart:
+    # A binary chart mapped into memory. The records are viewed in place as
+    # a NumPy structured array, so opening costs the same for any chart
+    # length and only the pages that are actually read get loaded.
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < CHART_HEADER.size:
+            raise ValueError(f"{path}: truncated chart")
+        magic, version, flags, count = CHART_HEADER.unpack_from(self.map)
+        if magic != CHART_MAGIC or version > CHART_VERSION:
+            raise ValueError(f"{path}: not a supported binary chart")
+        index_offset = CHART_HEADER.size + count * CHART_RECORD.size
+        if len(self.map) < index_offset:
+            raise ValueError(f"{path}: truncated chart")
+        self.records = np.frombuffer(self.map, dtype=CHART_DTYPE, count=count, offset=CHART_HEADER.size)
+        self.index = None
+        if flags & CHART_FLAG_INDEX:
+            self.index = np.frombuffer(self.map, dtype='<u4', offset=index_offset,
+                                       count=(len(self.map) - index_offset) // CHART_INDEX_ENTRY.size)
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def seek(self, seconds):
+        # Position of the first record at or after `seconds`. The index
+        # narrows the search to that second's records, so only a page or two
+        # of the file is touched however large the chart is.
+        time_ms = max(0, math.ceil(seconds * 1000))
+        low, high = 0, len(self.records)
+        if self.index is not None:
+            second = time_ms // 1000
+            if second >= len(self.index):
+                return len(self.records)
+            low = int(self.index[second])
+            if second + 1 < len(self.index):
+                high = int(self.index[second + 1])
+        return low + int(np.searchsorted(self.records['time_ms'][low:high], time_ms))
+    
+    def iter_from(self, seconds=0.0):
+        """Yield ChartNotes starting at the first note at or after `seconds`"""
+        last_ms = 0
+        for start in range(self.seek(seconds), len(self.records), CHART_CHUNK_RECORDS):
+            chunk = self.records[start:start + CHART_CHUNK_RECORDS]
+            # Validate a whole chunk at once; records are only checked as they are streamed
+            times = chunk['time_ms']
+            bad = (chunk['track'] >= TRACK_COUNT) | (chunk['note_type'] >= len(NOTE_TYPES))
+            bad[1:] |= times[1:] < times[:-1]
+            bad[0] |= times[0] < last_ms
+            if bad.any():
+                offset = int(np.argmax(bad))
+                previous = int(times[offset - 1]) if offset else last_ms
+                time_ms, track, note_type, _ = chunk[offset].tolist()
+                check_chart_record(self.path, start + offset, time_ms, track, note_type, previous)
+            last_ms = int(times[-1])
+            for time_ms, track, note_type, hold_ms in chunk.tolist():
+                yield ChartNote(time_ms / 1000, track, NOTE_TYPES[note_type], hold_ms / 1000)
+
+
+def iter_chart(path, start=0.0):
+    """Stream notes at or after `start` seconds from a chart file, detecting binary or text form"""
+    with open(path, 'rb') as f:
+        binary = f.read(len(CHART_MAGIC)) == CHART_MAGIC
+    if binary and np is not None:
+        return MappedChart(path).iter_from(start)
+    notes = iter_binary_chart(path) if binary else iter_text_chart(path)
+    return (note for note in notes if note.time >= start)
+
+
+def chart_digest(path):
+    """SHA-1 of a chart file's bytes"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def write_chart(path, notes, binary=True):
+    """Write ChartNotes (sorted by time) as a binary chart with a seek index, or as a text chart"""
+    notes = sorted(notes, key=lambda note: note.time)
+    if binary:
+        times = [int(round(note.time * 1000)) for note in notes]
+        for index, (time_ms, note) in enumerate(zip(times, notes)):
+            if not 0 <= time_ms <= 0xFFFFFFFF:
+                raise ValueError(f"note {index}: time {note.time} s is outside a binary chart's range (0 to {0xFFFFFFFF / 1000} s)")
+            if not 0 <= int(round(note.hold * 1000)) <= 0xFFFF:
+                raise ValueError(f"note {index}: hold {note.hold} s is outside a binary chart's range (0 to {0xFFFF / 1000} s)")
+            if not 0 <= note.track < TRACK_COUNT or note.note_type not in NOTE_TYPES:
+                raise ValueError(f"note {index}: invalid track or note type")
+        last_second = times[-1] // 1000 if times else 0
+        with open(path, 'wb') as f:
+            f.write(CHART_HEADER.pack(CHART_MAGIC, CHART_VERSION, CHART_FLAG_INDEX, len(notes)))
+            for time_ms, note in zip(times, notes):
+                f.write(CHART_RECORD.pack(time_ms, note.track,
+                                          NOTE_TYPES.index(note.note_type), int(round(note.hold * 1000))))
+            for second in range(last_second + 1):
+                f.write(CHART_INDEX_ENTRY.pack(bisect.bisect_left(times, second * 1000)))
+    else:
+        with open(path, 'w') as f:
+            for note in notes:
+                line = f"{int(round(note.time * 1000))} {note.track} {note.note_type}"
+                if note.hold:
+                    line += f" {int(round(note.hold * 1000))}"
+                f.write(line + "\n")
+
+
+class ChartStream:
+    # Feeds chart notes into the note store just ahead of the playhead.
+    # Only the next pending note is held in memory, so chart length does
+    # not matter.
+    def __init__(self, notes):
+        self.notes = iter(notes)
+        self.pending = next(self.notes, None)
+    
+    @property
+    def finished(self):
+        return self.pending is None
+    
+    def spawn_due(self, game, now):
+        # Spawn every note that has to be on screen by `now`
+        while self.pending is not None:
+            spawn_time = self.pending.time - TARGET_Y / game.note_speed
+            if spawn_time > now:
+                break
+            game.add_note(self.pending.track, self.pending.note_type, spawn_time, self.pending.hold)
+            self.pending = next(self.notes, None)
+
+
 class ComboEffect:
-    def __init__(self, x, y, combo, font):
+    def __init__(self, x, y, combo):
         self.x = x
         self.y = y
         self.combo = combo
-        self.font = pygame.font.SysFont(None, 48)  # Larger font for combo
-        self.lifetime = 1.0
+        self.font_size = 48  # Larger font for combo
+        self.duration = EFFECT_LIFETIME
+        self.lifetime = self.duration  # Seconds
         self.scale = 1.0
         
         # Different colors based on combo milestones
@@ -531,63 +1573,308 @@ class ComboEffect:
         else:
             self.color = WHITE
             
-        self.text_surface = self.font.render(f"{combo} COMBO!", True, self.color)
-        self.text_rect = self.text_surface.get_rect(center=(x, y - 50))  # Position above hit area
+        self.text = f"{combo} COMBO!"
+        self.text_rect = text_cache.render(self.text, self.font_size, self.color).get_rect(center=(x, y - 50))  # Position above hit area
         
-    def update(self):
-        self.lifetime -= 0.02
+    def update(self, dt):
+        self.lifetime -= dt
         
         # Pulsating effect
-        self.scale = 1.0 + 0.2 * math.sin(self.lifetime * 10)
+        self.scale = 1.0 + 0.2 * math.sin(self.lifetime / self.duration * 10)
         
         return self.lifetime > 0
         
     def draw(self, screen):
-        # Scale the text for pulsating effect
-        scaled_surface = pygame.transform.scale(
-            self.text_surface, 
-            (int(self.text_surface.get_width() * self.scale), 
-             int(self.text_surface.get_height() * self.scale))
-        )
-        
-        scaled_rect = scaled_surface.get_rect(center=self.text_rect.center)
-        
-        # Apply fade out
-        alpha = int(self.lifetime * 255)
-        temp_surface = pygame.Surface(scaled_surface.get_size(), pygame.SRCALPHA)
-        temp_surface.fill((0, 0, 0, 0))  # Transparent
-        temp_surface.blit(scaled_surface, (0, 0))
-        temp_surface.set_alpha(alpha)
-        
-        screen.blit(temp_surface, scaled_rect)
+        # Pulsating, fading text comes pre-baked from the sprite bank
+        frame = effect_sprites.pulse(self.text, self.font_size, self.color, self.scale, self.lifetime / self.duration)
+        return screen.blit(frame, frame.get_rect(center=self.text_rect.center))
 
 class HitEffect:
-    def __init__(self, x, y, text, color, font):
+    def __init__(self, x, y, text, color, font_size):
         self.x = x
         self.y = y
         self.text = text
         self.color = color
-        self.font = font
-        self.lifetime = 1.0  # 1.0 to 0.0
-        self.text_surface = self.font.render(text, True, color)
-        self.text_rect = self.text_surface.get_rect(center=(x, y))
+        self.font_size = font_size
+        self.duration = EFFECT_LIFETIME
+        self.lifetime = self.duration  # Seconds
+        self.text_rect = text_cache.render(text, font_size, color).get_rect(center=(x, y))
         
-    def update(self):
-        self.y -= 2  # Move up
-        self.lifetime -= 0.02
+    def update(self, dt):
+        self.y -= 120 * dt  # Move up (pixels per second)
+        self.lifetime -= dt
         self.text_rect.center = (self.x, self.y)
         return self.lifetime > 0
         
     def draw(self, screen):
-        alpha = int(self.lifetime * 255)
-        temp_surface = pygame.Surface(self.text_surface.get_size(), pygame.SRCALPHA)
-        temp_surface.fill((0, 0, 0, 0))  # Transparent
-        temp_surface.blit(self.text_surface, (0, 0))
-        temp_surface.set_alpha(alpha)
-        screen.blit(temp_surface, self.text_rect)
+        alpha = self.lifetime / self.duration
+        return screen.blit(effect_sprites.fade(self.text, self.font_size, self.color, alpha), self.text_rect)
+class SimulatedClock:
+    # Injectable time source for headless runs: time only moves when advanced
+    def __init__(self, start=0.0):
+        self.now = start
+    
+    def advance(self, seconds):
+        self.now += seconds
+    
+    def __call__(self):
+        return self.now
+
+
+class SongClock:
+    # Game time driven by the backing track. The track is streamed by
+    # mixer.music, so memory stays flat however long the song is.
+    # get_pos() only moves once per mixed audio buffer, so frame time fills
+    # in between readings and each new reading corrects the drift. The
+    # clock never runs backwards.
+    def __init__(self, position=0.0, start=0.0):
+        self.position = position  # Game time (seconds); song time once playing
+        self.start = start  # Song position at which playback begins
+        self.playing = False
+        self.last_pos = -1
+    
+    def update(self, frame_time):
+        estimate = self.position + frame_time
+        if not self.playing:
+            # Lead-in before the song starts runs on frame time
+            if estimate < self.start:
+                self.position = estimate
+                return self.position
+            pygame.mixer.music.play(start=self.start)
+            self.playing = True
+            self.position = self.start
+            return self.position
+        
+        pos = pygame.mixer.music.get_pos()  # ms since play(), -1 once the song has ended
+        if pos >= 0 and pos != self.last_pos:
+            self.last_pos = pos
+            error = self.start + pos / 1000 - estimate
+            if abs(error) > SONG_RESYNC_THRESHOLD:
+                estimate += error
+            else:
+                estimate += error * SONG_DRIFT_GAIN
+        self.position = max(self.position, estimate)
+        return self.position
+    
+    def pause(self):
+        if self.playing:
+            pygame.mixer.music.pause()
+    
+    def unpause(self):
+        if self.playing:
+            pygame.mixer.music.unpause()
+    
+    def stop(self):
+        if self.playing:
+            pygame.mixer.music.stop()
+            self.playing = False
+
+
+class InputSampler:
+    # Timestamps key events as soon as they are seen and queues them with
+    # their capture time for handle_input. SDL only delivers events on the
+    # thread that owns the window, so rather than a thread the main loop
+    # polls here between phases and throughout the frame wait.
+    def __init__(self, time_source=time.perf_counter):
+        self.time_source = time_source
+        self.events = deque()  # (event, capture timestamp)
+        self.deadline = None
+    
+    def poll(self):
+        events = pygame.event.get((pygame.KEYDOWN, pygame.KEYUP))
+        if events:
+            timestamp = self.time_source()
+            self.events.extend((event, timestamp) for event in events)
+    
+    def drain(self):
+        while self.events:
+            yield self.events.popleft()
+    
+    def wait_frame(self, fps):
+        # Stands in for clock.tick(fps): sleep until the next frame is due,
+        # polling input every INPUT_POLL_INTERVAL. A late frame resets the
+        # schedule instead of rushing to catch up.
+        now = time.perf_counter()
+        deadline = now if self.deadline is None else max(self.deadline + 1.0 / fps, now)
+        while True:
+            self.poll()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, INPUT_POLL_INTERVAL))
+        self.deadline = deadline
+
+
+class FrameProfiler:
+    # Per-phase frame timing. Sub-phases are named after their phase
+    # ('draw.notes' is part of 'draw'). The last PROFILE_HISTORY frames feed
+    # the overlay percentiles; with tracing on every frame is also kept for
+    # export.
+    def __init__(self, trace=False):
+        self.history = {}  # Phase -> deque of recent per-frame milliseconds
+        self.frame = {}  # Phase -> milliseconds so far this frame
+        self.counts = {}
+        self.tracing = trace
+        self.trace = []
+        self.lines = []
+        self.next_refresh = 0
+        self.cprofile = None
+    
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.frame[name] = self.frame.get(name, 0.0) + (time.perf_counter() - start) * 1000
+    
+    def sample(self, name, ms):
+        # Record a measurement that is not a phase of the frame (e.g. input latency)
+        if name not in self.history:
+            self.history[name] = deque(maxlen=PROFILE_HISTORY)
+        self.history[name].append(ms)
+    
+    def end_frame(self, **counts):
+        for name, ms in self.frame.items():
+            self.sample(name, ms)
+        self.counts = counts
+        if self.tracing:
+            row = dict(self.frame)
+            row.update(counts)
+            self.trace.append(row)
+        self.frame = {}
+    
+    def summary(self):
+        """(p50, p95, p99) milliseconds per phase over the recent frames"""
+        result = {}
+        for name in sorted(self.history):
+            samples = sorted(self.history[name])
+            result[name] = tuple(percentile(samples, fraction) for fraction in (0.50, 0.95, 0.99))
+        return result
+    
+    def draw(self, screen):
+        # Percentile table in the top-right corner, refreshed a few times a
+        # second so the numbers stay readable
+        now = time.perf_counter()
+        if now >= self.next_refresh:
+            self.next_refresh = now + PROFILE_REFRESH
+            self.lines = [("ms", "p50", "p95", "p99")]
+            for name, values in self.summary().items():
+                self.lines.append((name,) + tuple(f"{value:.2f}" for value in values))
+            self.lines.append((" ".join(f"{name} {count}" for name, count in self.counts.items()), "", "", ""))
+        
+        size = int(18 * SCALE_Y)
+        row_height = size
+        column_width = int(60 * SCALE_X)
+        width = int(150 * SCALE_X) + 3 * column_width
+        left = SCREEN_WIDTH - width - int(10 * SCALE_X)
+        top = int(90 * SCALE_Y)
+        panel = pygame.Surface((width, row_height * len(self.lines) + 8), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 180))
+        screen.blit(panel, (left, top))
+        for row, cells in enumerate(self.lines):
+            y = top + 4 + row * row_height
+            screen.blit(text_cache.render(cells[0], size, WHITE), (left + 4, y))
+            for column, cell in enumerate(cells[1:], 1):
+                text = text_cache.render(cell, size, WHITE)
+                x = left + int(150 * SCALE_X) + column * column_width - text.get_width() - 4
+                screen.blit(text, (x, y))
+    
+    def export(self, path):
+        """Write the per-frame trace as JSON (.json) or CSV"""
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump(self.trace, f)
+            return
+        import csv
+        columns = sorted({name for row in self.trace for name in row})
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(self.trace)
+    
+    def toggle_cprofile(self):
+        # Start a cProfile capture, or stop it, save it and print the top entries
+        import cProfile
+        import pstats
+        if self.cprofile is None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+            print("cProfile capture started")
+            return
+        self.cprofile.disable()
+        path = time.strftime("rhythm_game_%Y%m%d_%H%M%S.prof")
+        self.cprofile.dump_stats(path)
+        pstats.Stats(self.cprofile).sort_stats('cumulative').print_stats(15)
+        print(f"cProfile capture saved to {path}")
+        self.cprofile = None
+
+
+class ReplayRecorder:
+    # Logs everything a run's outcome depends on besides the seed: the game
+    # time of every simulation step, gameplay keys, offset changes and
+    # resizes. Times are rounded to whole microseconds and handed back so
+    # the live game continues on exactly the values a replay will see.
+    def __init__(self, seed, chart_path=None, chart_start=0.0, start_time=0.0):
+        self.seed = seed
+        self.width = SCREEN_WIDTH
+        self.height = SCREEN_HEIGHT
+        self.chart_path = chart_path or ""
+        self.chart_start = chart_start
+        # Ties the replay to the chart's contents, not just its (relative) path
+        self.chart_digest = chart_digest(chart_path) if chart_path else bytes(20)
+        self.log = bytearray()
+        # Deltas are relative to the session's starting game time, which
+        # can be far past what a 32-bit microsecond delta holds
+        self.start_us = round(start_time * 1e6)
+        self.last_us = self.start_us
+    
+    def record(self, kind, seconds, argument=0):
+        us = round(seconds * 1e6)
+        self.log += REPLAY_RECORD.pack(kind, us - self.last_us, argument)
+        self.last_us = us
+        return us / 1e6
+    
+    def frame(self, now):
+        return self.record(REPLAY_FRAME, now)
+    
+    def key(self, key, press_time):
+        return self.record(REPLAY_KEY, press_time, key)
+    
+    def offsets(self, audio_ms, input_ms):
+        audio_us = round(audio_ms * 1000)
+        input_us = round(input_ms * 1000)
+        self.record(REPLAY_AUDIO_OFFSET, self.last_us / 1e6, audio_us)
+        self.record(REPLAY_INPUT_OFFSET, self.last_us / 1e6, input_us)
+        return audio_us / 1000, input_us / 1000
+    
+    def resize(self, width, height):
+        self.record(REPLAY_RESIZE, self.last_us / 1e6, width << 16 | height)
+    
+    def save(self, path, result):
+        chart_path = self.chart_path.encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.seed, self.width, self.height,
+                                       self.chart_start, self.start_us, self.chart_digest,
+                                       len(self.log) // REPLAY_RECORD.size, len(chart_path)))
+            f.write(chart_path)
+            f.write(REPLAY_RESULT.pack(result['score'], result['max_combo'], result['perfect'], result['good'],
+                                       result['misses'], result['grade'].encode('ascii')))
+            f.write(zlib.compress(bytes(self.log), 9))
+
+
 class RhythmGame:
-    def __init__(self):
+    def __init__(self, note_engine='lanes', dirty_rects=False, time_source=time.perf_counter, rng=random,
+                 headless=None, chart_path=None, chart_start=0.0, music_path=None, settings=None,
+                 profile_path=None, replay_dir=None):
+        # Injectable clock and RNG so runs can be simulated deterministically
+        self.time_source = time_source
+        self.rng = rng
+        startup(headless)
+        self.headless = HEADLESS if headless is None else headless
+        
         # Create a fullscreen or windowed display based on screen size
+        start = time.perf_counter()
         if user_screen_width >= 1920 and user_screen_height >= 1080:
             # For large screens, use a windowed mode with the calculated size
             self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
@@ -596,32 +1883,97 @@ class RhythmGame:
             self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.RESIZABLE)
             
         pygame.display.set_caption("Rhythm Master")
+        record_phase('display_mode', start)
+        self.playfield = None  # Cached static background, built on first draw
+        
+        # Dirty-rect rendering: repaint and push only regions that changed
+        self.dirty_rects = dirty_rects
+        self.needs_full_redraw = True
+        self.drawn_rects = []
+        self.dynamic_rects = []
+        self.hud_state = {}
         self.clock = pygame.time.Clock()
-        self.font = pygame.font.SysFont(None, int(36 * SCALE_Y))
         
-        # Game state
+        # Frame timing: F3 toggles the overlay, F9 starts/stops a cProfile capture
+        self.profiler = FrameProfiler(trace=profile_path is not None)
+        self.profile_path = profile_path  # Per-frame trace written here on exit
+        self.show_profiler = False
+        self.input_sampler = InputSampler(time_source)
+        
+        self.font_size = int(36 * SCALE_Y)
+        self.font = text_cache.get_font(self.font_size)
+        self.note_engine = note_engine
+        self.chart_path = chart_path  # Authored chart to play instead of random notes
+        self.chart_start = chart_start  # Chart time (seconds) to start from, for practice
+        
+        # Backing track; when set, game time follows its playback position
+        self.music_path = None
+        if music_path:
+            try:
+                pygame.mixer.music.load(music_path)
+                self.music_path = music_path
+            except pygame.error as e:
+                print(f"Could not load music: {e}")
+        
+        # Load sound effects
+        start = time.perf_counter()
+        self.load_sounds()
+        record_phase('sound_bank', start)
+        log_startup_timings()
+        
+        # Calibrated latency offsets
+        self.settings = load_settings() if settings is None else settings
+        
+        # Scores are saved in the background; headless runs (benchmarks,
+        # replays, tools) don't save
+        self.score_writer = None if self.headless else ScoreWriter()
+        
+        # Each session is recorded to a replay in this directory when set
+        self.replay_dir = replay_dir
+        self.recorder = None
+        
+        # Key mappings (Up, Down, Right, Left for 4 tracks)
+        self.key_mappings = [pygame.K_UP, pygame.K_DOWN, pygame.K_RIGHT, pygame.K_LEFT]
+        
         self.running = True
+        self.reset_session()
+    
+    def reset_session(self):
+        # Reset per-run state only. The window, clock, fonts, render caches
+        # and sound bank are kept, so restarting takes milliseconds.
+        
+        # A recorded session gets its own seed so its replay stands alone
+        if self.replay_dir is not None:
+            seed = random.randrange(2 ** 63)
+            self.rng = random.Random(seed)
+        
+        # Game state
         self.score = 0
         self.level = 1
         self.combo = 0
         self.max_combo = 0
         self.health = 100
-        self.notes = []
+        self.notes = NOTE_ENGINES[self.note_engine]()
         self.hit_effects = []
         self.combo_effects = []
         self.animal_animations = []  # List to store active animal animations
-        self.start_time = time.time()
-        self.elapsed_time = 0
-        self.next_note_time = 1.0  # Time until next note spawn
+        self.start_time = self.time_source()
+        self.last_update_time = self.start_time
+        self.elapsed_time = 0  # Game time in seconds (excludes pauses)
+        self.next_note_time = 1.0  # Game time of the next note spawn
         # Difficulty settings
         self.difficulty = 'normal'  # Default difficulty
         self.apply_difficulty_settings()
-        
-        # Load sound effects
-        self.load_sounds()
-        
-        # Key mappings (Up, Down, Right, Left for 4 tracks)
-        self.key_mappings = [pygame.K_UP, pygame.K_DOWN, pygame.K_RIGHT, pygame.K_LEFT]
+        self.chart = None
+        if self.chart_path:
+            self.chart = ChartStream(iter_chart(self.chart_path, self.chart_start))
+            if self.chart_start > 0:
+                # Start a second before the first note has to enter the screen
+                self.elapsed_time = max(0.0, self.chart_start - TARGET_Y / self.note_speed - 1.0)
+        self.song = SongClock(self.elapsed_time, self.chart_start) if self.music_path else None
+        if self.replay_dir is not None:
+            self.recorder = ReplayRecorder(seed, self.chart_path, self.chart_start, self.elapsed_time)
+        self.apply_offsets()
         
         # Game state
         self.paused = False
@@ -635,106 +1987,25 @@ class RhythmGame:
         # Level up effect
         self.level_up_time = 0
         self.show_level_up = False
+        
+        # The game over screen drew over everything
+        self.needs_full_redraw = True
+        
     def load_sounds(self):
         # Create dictionary for sound effects
         self.sound_effects = {}
         
-        # Create funny sound effects using pygame's synthesizer capabilities
+        # Create funny sound effects from the synthesized (and disk-cached) sound bank
         try:
-            import numpy as np
-            
-            # Create a perfect hit sound (ascending happy tones)
-            perfect_buffer = np.zeros((44100,), dtype=np.int16)
-            for i in range(5000):
-                perfect_buffer[i] = int(32767 * np.sin(i/10) * np.exp(-i/4000))
-                perfect_buffer[i+5000] = int(32767 * np.sin(i/8) * np.exp(-i/4000))
-                perfect_buffer[i+10000] = int(32767 * np.sin(i/6) * np.exp(-i/4000))
-            self.sound_effects['perfect'] = pygame.mixer.Sound(buffer=perfect_buffer)
-            
-            # Create a good hit sound (medium tone)
-            good_buffer = np.zeros((44100,), dtype=np.int16)
-            for i in range(8000):
-                good_buffer[i] = int(32767 * np.sin(i/12) * np.exp(-i/4000))
-            self.sound_effects['good'] = pygame.mixer.Sound(buffer=good_buffer)
-            
-            # Create a miss sound (descending sad tones)
-            miss_buffer = np.zeros((44100,), dtype=np.int16)
-            for i in range(10000):
-                miss_buffer[i] = int(32767 * np.sin((10000-i)/8) * np.exp(-i/8000))
-            self.sound_effects['miss'] = pygame.mixer.Sound(buffer=miss_buffer)
-            
-            # Create a level up sound (triumphant fanfare)
-            level_up_buffer = np.zeros((44100,), dtype=np.int16)
-            for i in range(5000):
-                level_up_buffer[i] = int(20000 * np.sin(i/4) * np.exp(-i/10000))
-            for i in range(5000):
-                level_up_buffer[i+5000] = int(20000 * np.sin(i/3) * np.exp(-i/10000))
-            for i in range(10000):
-                level_up_buffer[i+10000] = int(20000 * np.sin(i/2) * np.exp(-i/10000))
-            self.sound_effects['level_up'] = pygame.mixer.Sound(buffer=level_up_buffer)
-            
-            # Create a combo sound (quick ascending notes)
-            combo_buffer = np.zeros((44100,), dtype=np.int16)
-            for i in range(2000):
-                combo_buffer[i] = int(20000 * np.sin(i/10) * np.exp(-i/2000))
-            for i in range(2000):
-                combo_buffer[i+2000] = int(20000 * np.sin(i/8) * np.exp(-i/2000))
-            for i in range(2000):
-                combo_buffer[i+4000] = int(20000 * np.sin(i/6) * np.exp(-i/2000))
-            self.sound_effects['combo'] = pygame.mixer.Sound(buffer=combo_buffer)
-            
-            # Create a game over sound (dramatic descending tones)
-            game_over_buffer = np.zeros((44100,), dtype=np.int16)
-            for i in range(20000):
-                game_over_buffer[i] = int(20000 * np.sin((20000-i)/2) * np.exp(-i/15000))
-                if i % 1000 < 500:  # Add pulsing effect
-                    game_over_buffer[i] = int(game_over_buffer[i] * 0.7)
-            self.sound_effects['game_over'] = pygame.mixer.Sound(buffer=game_over_buffer)
-            
-            # Create animal sounds
-            # Bird chirp
-            bird_buffer = np.zeros((44100,), dtype=np.int16)
-            for i in range(1000):
-                bird_buffer[i] = int(20000 * np.sin(i/2) * np.exp(-i/500))
-            for i in range(1000):
-                bird_buffer[i+1500] = int(20000 * np.sin(i/1.5) * np.exp(-i/500))
-            self.sound_effects['bird'] = pygame.mixer.Sound(buffer=bird_buffer)
-            
-            # Frog ribbit
-            frog_buffer = np.zeros((44100,), dtype=np.int16)
-            for i in range(3000):
-                frog_buffer[i] = int(20000 * np.sin(i/20) * np.exp(-i/2000))
-                if i % 200 < 100:  # Add warble
-                    frog_buffer[i] = int(frog_buffer[i] * 0.7)
-            self.sound_effects['frog'] = pygame.mixer.Sound(buffer=frog_buffer)
-            
-            # Rabbit hop
-            rabbit_buffer = np.zeros((44100,), dtype=np.int16)
-            for i in range(1000):
-                rabbit_buffer[i] = int(10000 * np.sin(i/8) * np.exp(-i/500))
-            self.sound_effects['rabbit'] = pygame.mixer.Sound(buffer=rabbit_buffer)
-            
-            # Cat meow
-            cat_buffer = np.zeros((44100,), dtype=np.int16)
-            for i in range(5000):
-                cat_buffer[i] = int(15000 * np.sin((5000-i)/15) * np.exp(-i/4000))
-                if i % 500 < 250:  # Add warble
-                    cat_buffer[i] = int(cat_buffer[i] * 1.2)
-            self.sound_effects['cat'] = pygame.mixer.Sound(buffer=cat_buffer)
-            
-            # Set appropriate volumes
-            self.sound_effects['perfect'].set_volume(0.4)
-            self.sound_effects['good'].set_volume(0.3)
-            self.sound_effects['miss'].set_volume(0.3)
-            self.sound_effects['level_up'].set_volume(0.5)
-            self.sound_effects['combo'].set_volume(0.4)
-            self.sound_effects['game_over'].set_volume(0.6)
-            self.sound_effects['bird'].set_volume(0.3)
-            self.sound_effects['frog'].set_volume(0.3)
-            self.sound_effects['rabbit'].set_volume(0.3)
-            self.sound_effects['cat'].set_volume(0.3)
-            
-            print("Custom sound effects created successfully!")
+            if np is None:
+                raise ImportError("numpy is required to synthesize sound effects")
+            
+            for name, samples in load_sound_bank().items():
+                self.sound_effects[name] = pygame.mixer.Sound(buffer=samples)
+                self.sound_effects[name].set_volume(SOUND_RECIPES[name]['volume'])
+            
+            footprint = sum(sound_bank_footprint(self.sound_effects).values())
+            print(f"Custom sound effects created successfully! ({footprint / 1024:.0f} KB)")
         except Exception as e:
             print(f"Error creating custom sounds: {e}")
             print("Using fallback sounds...")
@@ -752,6 +2023,7 @@ class RhythmGame:
                 self.sound_effects['frog'] = pygame.mixer.Sound(buffer=bytes([128] * 3000))
                 self.sound_effects['rabbit'] = pygame.mixer.Sound(buffer=bytes([128] * 1000))
                 self.sound_effects['cat'] = pygame.mixer.Sound(buffer=bytes([128] * 4000))
+                self.sound_effects['tick'] = pygame.mixer.Sound(buffer=bytes([128] * 1000))
                 
                 # Set volumes
                 for key in self.sound_effects:
@@ -761,85 +2033,145 @@ class RhythmGame:
             except Exception as e2:
                 print(f"Could not create fallback sounds: {e2}")
                 print("Game will run without sound effects")
+        
+        self.sound_pool = SoundPool(self.sound_effects)
     def apply_difficulty_settings(self):
         settings = DIFFICULTY_SETTINGS[self.difficulty]
-        self.note_speed = settings['note_speed']
+        self.note_speed = settings['note_speed'] * SCALE_Y
         self.spawn_rate_min = settings['spawn_rate_min']
         self.spawn_rate_max = settings['spawn_rate_max']
-        self.perfect_threshold = settings['perfect_threshold']
-        self.good_threshold = settings['good_threshold']
+        self.perfect_window_ms = settings['perfect_window_ms']
+        self.good_window_ms = settings['good_window_ms']
     
-    def spawn_note(self):
-        track = random.randint(0, TRACK_COUNT - 1)
+    def apply_offsets(self):
+        # A tap lands audio + input latency after the note's sound plays,
+        # so judge taps that much earlier. Notes are drawn audio latency
+        # late, so they cross the target when the player hears them.
+        audio_ms = self.settings['audio_offset_ms']
+        input_ms = self.settings['input_offset_ms']
+        if self.recorder is not None:
+            audio_ms, input_ms = self.recorder.offsets(audio_ms, input_ms)
+        self.judge_offset = (audio_ms + input_ms) / 1000
+        self.render_offset = audio_ms / 1000
+    
+    def add_note(self, track, note_type, spawn_time, hold=0.0):
+        self.notes.spawn(track, self.note_speed, note_type, spawn_time, hold)
+        self.total_notes += 1
+    
+    def spawn_note(self, spawn_time):
+        track = self.rng.randint(0, TRACK_COUNT - 1)
         
         # Randomly decide if this will be a special note (10% chance)
         note_type = "normal"
-        rand_val = random.random()
+        rand_val = self.rng.random()
         if rand_val < 0.1:
             note_type = "special"
         elif rand_val < 0.2:
             note_type = "hold"
             
-        self.notes.append(Note(track, self.note_speed, note_type))
-        self.total_notes += 1
+        self.add_note(track, note_type, spawn_time)
+    
+    def game_time_at(self, timestamp):
+        # Convert a time_source() timestamp into game time
+        if self.paused:
+            return self.elapsed_time
+        return self.elapsed_time + min(timestamp - self.last_update_time, MAX_FRAME_TIME)
     
     def handle_input(self):
+        # Key events carry the time the input sampler first saw them, so
+        # judgment does not depend on when in the frame they are handled
+        self.input_sampler.poll()
+        for event, timestamp in self.input_sampler.drain():
+            self.handle_event(event, self.game_time_at(timestamp))
+            if event.type == pygame.KEYDOWN and event.key in self.key_mappings:
+                self.profiler.sample('input.latency', (self.time_source() - timestamp) * 1000)
+        
+        # Everything else (window, quit) is handled once per frame
+        now = self.game_time_at(self.time_source())
         for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                self.running = False
-            
-            # Handle window resize events
-            if event.type == pygame.VIDEORESIZE:
-                # Update screen size
-                global SCREEN_WIDTH, SCREEN_HEIGHT, SCALE_X, SCALE_Y, TRACK_WIDTH, TARGET_Y
-                SCREEN_WIDTH = event.w
-                SCREEN_HEIGHT = event.h
-                SCALE_X = SCREEN_WIDTH / BASE_WIDTH
-                SCALE_Y = SCREEN_HEIGHT / BASE_HEIGHT
-                TRACK_WIDTH = SCREEN_WIDTH // (TRACK_COUNT + 1)
-                TARGET_Y = SCREEN_HEIGHT - int(100 * SCALE_Y)
-                
-                # Update difficulty settings with new scaling
-                self.apply_difficulty_settings()
-            
-            if event.type == pygame.KEYDOWN:
-                # Check if a track key was pressed
-                for i, key in enumerate(self.key_mappings):
-                    if event.key == key:
-                        self.check_note_hit(i)
+            self.handle_event(event, now)
+    
+    def handle_event(self, event, press_time):
+        if event.type == pygame.QUIT:
+            self.running = False
+        
+        # Handle window resize events
+        if event.type == pygame.VIDEORESIZE:
+            self.resize(event.w, event.h)
+        
+        if event.type == pygame.KEYDOWN:
+            # Track keys and difficulty changes
+            self.press(event.key, press_time)
+            
+            # Escape key to pause/unpause
+            if event.key == pygame.K_ESCAPE:
+                self.paused = not self.paused
+                if self.song is not None:
+                    if self.paused:
+                        self.song.pause()
+                    else:
+                        self.song.unpause()
+            
+            # Profiling
+            if event.key == pygame.K_F3:
+                self.show_profiler = not self.show_profiler
+                self.needs_full_redraw = True
+            elif event.key == pygame.K_F9:
+                self.profiler.toggle_cprofile()
+            
+            # Latency calibration from the pause screen
+            if event.key == pygame.K_c and self.paused:
+                self.calibrate()
                 
-                # Escape key to pause/unpause
-                if event.key == pygame.K_ESCAPE:
-                    self.paused = not self.paused
-                    
-                # Difficulty change keys (1, 2, 3)
-                if event.key == pygame.K_1:
-                    self.difficulty = 'easy'
-                    self.apply_difficulty_settings()
-                elif event.key == pygame.K_2:
-                    self.difficulty = 'normal'
-                    self.apply_difficulty_settings()
-                elif event.key == pygame.K_3:
-                    self.difficulty = 'hard'
-                    self.apply_difficulty_settings()
-                    
-                # Toggle fullscreen with F11
-                if event.key == pygame.K_F11:
-                    pygame.display.toggle_fullscreen()
-    def check_note_hit(self, track):
-        # Find the closest active note in the pressed track
-        closest_note = None
-        min_distance = float('inf')
+            # Toggle fullscreen with F11
+            if event.key == pygame.K_F11:
+                pygame.display.toggle_fullscreen()
+    def resize(self, width, height):
+        # Update screen size
+        configure_resolution(width, height)
+        if self.recorder is not None:
+            self.recorder.resize(width, height)
+        
+        # Cached fonts, text, effect frames and the playfield were rendered for the old scale
+        text_cache.clear()
+        effect_sprites.clear()
+        note_atlas.clear()
+        animal_frames.clear()
+        self.playfield = None
+        self.needs_full_redraw = True
+        self.font_size = int(36 * SCALE_Y)
+        self.font = text_cache.get_font(self.font_size)
         
-        for note in self.notes:
-            if note.active and note.track == track and not note.hit:
-                distance = abs(note.y - TARGET_Y)
-                if distance < min_distance:
-                    min_distance = distance
-                    closest_note = note
+        # Update difficulty settings with new scaling
+        self.apply_difficulty_settings()
+    
+    def press(self, key, press_time):
+        # Gameplay keys: track hits and difficulty changes (1, 2, 3). With
+        # the step times these are all a replay needs to reproduce a run.
+        difficulty = {pygame.K_1: 'easy', pygame.K_2: 'normal', pygame.K_3: 'hard'}.get(key)
+        if key not in self.key_mappings and difficulty is None:
+            return
+        if self.recorder is not None:
+            press_time = self.recorder.key(key, press_time)
+        
+        if difficulty is not None:
+            self.difficulty = difficulty
+            self.apply_difficulty_settings()
+        else:
+            self.check_note_hit(self.key_mappings.index(key), press_time)
+    
+    def check_note_hit(self, track, press_time=None):
+        # Judge against the time of the keypress (game time, seconds)
+        if press_time is None:
+            press_time = self.game_time_at(self.time_source())
+        press_time -= self.judge_offset
+        
+        # Find the note in the pressed track closest in time
+        closest_note = self.notes.nearest(track, press_time)
         
         # Check if we found a note and it's within the hit threshold
         if closest_note is not None:
+            min_distance = abs(press_time - closest_note.hit_time) * 1000  # Milliseconds
             x = (track + 1) * TRACK_WIDTH - TRACK_WIDTH // 2
             
             # Calculate score multiplier based on note type and level
@@ -849,7 +2181,7 @@ class RhythmGame:
             elif closest_note.note_type == "hold":
                 score_multiplier *= 1.5
             
-            if min_distance <= self.perfect_threshold:
+            if min_distance <= self.perfect_window_ms:
                 points = int(100 * score_multiplier)
                 self.score += points
                 self.combo += 1
@@ -860,26 +2192,25 @@ class RhythmGame:
                 
                 # Show different text for streaks
                 if self.perfect_streak >= 5:
-                    self.hit_effects.append(HitEffect(x, TARGET_Y, f"PERFECT x{self.perfect_streak}!", GREEN, self.font))
+                    self.hit_effects.append(HitEffect(x, TARGET_Y, f"PERFECT x{self.perfect_streak}!", GREEN, self.font_size))
                 else:
-                    self.hit_effects.append(HitEffect(x, TARGET_Y, "PERFECT!", GREEN, self.font))
+                    self.hit_effects.append(HitEffect(x, TARGET_Y, "PERFECT!", GREEN, self.font_size))
                 
                 # Create animal animation for perfect hit
                 self.animal_animations.append(AnimalAnimation(x, TARGET_Y - 20, track))
                 
                 # Play animal sound based on track
                 animal_sound = ["bird", "frog", "rabbit", "cat"][track]
-                if animal_sound in self.sound_effects:
-                    self.sound_effects[animal_sound].play()
+                self.sound_pool.play(animal_sound)
                 
                 closest_note.hit = True
                 closest_note.active = False
+                self.notes.remove(closest_note)
                 
                 # Play perfect sound
-                if 'perfect' in self.sound_effects:
-                    self.sound_effects['perfect'].play()
+                self.sound_pool.play('perfect')
                 
-            elif min_distance <= self.good_threshold:
+            elif min_distance <= self.good_window_ms:
                 points = int(50 * score_multiplier)
                 self.score += points
                 self.combo += 1
@@ -887,7 +2218,7 @@ class RhythmGame:
                 self.good_hits += 1
                 self.notes_hit += 1
                 self.health = min(100, self.health + 1)
-                self.hit_effects.append(HitEffect(x, TARGET_Y, "GOOD!", BLUE, self.font))
+                self.hit_effects.append(HitEffect(x, TARGET_Y, "GOOD!", BLUE, self.font_size))
                 
                 # Create smaller animal animation for good hit
                 animal = AnimalAnimation(x, TARGET_Y - 10, track)
@@ -896,21 +2227,20 @@ class RhythmGame:
                 
                 closest_note.hit = True
                 closest_note.active = False
+                self.notes.remove(closest_note)
                 
                 # Play good sound
-                if 'good' in self.sound_effects:
-                    self.sound_effects['good'].play()
+                self.sound_pool.play('good')
                 
             else:
                 self.combo = 0
                 self.perfect_streak = 0
                 self.health -= 5
                 self.misses += 1
-                self.hit_effects.append(HitEffect(x, TARGET_Y, "MISS!", RED, self.font))
+                self.hit_effects.append(HitEffect(x, TARGET_Y, "MISS!", RED, self.font_size))
                 
                 # Play miss sound
-                if 'miss' in self.sound_effects:
-                    self.sound_effects['miss'].play()
+                self.sound_pool.play('miss')
             
             # Update max combo
             if self.combo > self.max_combo:
@@ -918,11 +2248,10 @@ class RhythmGame:
                 
             # Show combo effect at certain thresholds
             if self.combo > 0 and self.combo % 10 == 0:
-                self.combo_effects.append(ComboEffect(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2, self.combo, self.font))
+                self.combo_effects.append(ComboEffect(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2, self.combo))
                 
                 # Play combo sound
-                if 'combo' in self.sound_effects:
-                    self.sound_effects['combo'].play()
+                self.sound_pool.play('combo')
             
             # Check for level up
             self.check_level_up()
@@ -940,17 +2269,31 @@ class RhythmGame:
             self.level_up_time = 2.0  # Show level up message for 2 seconds
             
             # Play level up sound
-            if 'level_up' in self.sound_effects:
-                self.sound_effects['level_up'].play()
+            self.sound_pool.play('level_up')
     
     def update(self):
+        # Measure the real time since the last update so the simulation
+        # runs at the same speed whatever the frame rate
+        current_time = self.time_source()
+        frame_time = min(current_time - self.last_update_time, MAX_FRAME_TIME)
+        self.last_update_time = current_time
+        
         if self.paused:
             return
             
-        # Update elapsed time
-        current_time = time.time()
-        frame_time = current_time - self.start_time - self.elapsed_time
-        self.elapsed_time += frame_time
+        # Update elapsed time, from the music's playback position when there is a backing track
+        if self.song is not None:
+            now = self.song.update(frame_time)
+        else:
+            now = self.elapsed_time + frame_time
+        if self.recorder is not None:
+            now = self.recorder.frame(now)
+        self.step(now, frame_time)
+    
+    def step(self, now, frame_time):
+        # Advance the simulation to game time `now`. Replays drive this
+        # directly with the recorded step times.
+        self.elapsed_time = now
         
         # Update level up effect
         if self.show_level_up:
@@ -958,37 +2301,48 @@ class RhythmGame:
             if self.level_up_time <= 0:
                 self.show_level_up = False
         
-        # Spawn new notes based on timing
-        self.next_note_time -= frame_time
-        if self.next_note_time <= 0:
-            self.spawn_note()
-            # Random time until next note based on difficulty
-            self.next_note_time = random.uniform(self.spawn_rate_min, self.spawn_rate_max)
-        
-        # Update all notes
-        for note in self.notes[:]:
-            note.update()
-            if note.missed:
+        # Spawn new notes based on timing. Notes are spawned at their scheduled
+        # time rather than the frame time, so a late frame does not shift them.
+        with self.profiler.phase('update.spawn'):
+            if self.chart is not None:
+                self.chart.spawn_due(self, self.elapsed_time)
+                if self.chart.finished and len(self.notes) == 0 and not self.hit_effects:
+                    self.finish_chart()
+                    return
+            while self.chart is None and self.next_note_time <= self.elapsed_time:
+                self.spawn_note(self.next_note_time)
+                # Random time until next note based on difficulty
+                self.next_note_time += self.rng.uniform(self.spawn_rate_min, self.spawn_rate_max)
+        
+        with self.profiler.phase('update.notes'):
+            # Expire notes that passed the target without being hit
+            missed = self.notes.expire(self.elapsed_time - self.judge_offset, self.good_window_ms / 1000)
+            if missed:
                 self.combo = 0
                 self.perfect_streak = 0
-                self.health -= 10
-                self.misses += 1
-                self.notes.remove(note)
-            elif not note.active:
-                self.notes.remove(note)
+                self.health -= 10 * missed
+                self.misses += missed
         
-        # Update hit effects
-        self.hit_effects = [effect for effect in self.hit_effects if effect.update()]
+            # Update positions of the remaining notes
+            self.notes.update(self.elapsed_time - self.render_offset, self.good_window_ms / 1000)
         
-        # Update combo effects
-        self.combo_effects = [effect for effect in self.combo_effects if effect.update()]
+        with self.profiler.phase('update.effects'):
+            # Update hit effects
+            self.hit_effects = [effect for effect in self.hit_effects if effect.update(frame_time)]
         
-        # Update animal animations
-        self.animal_animations = [animal for animal in self.animal_animations if animal.update()]
+            # Update combo effects
+            self.combo_effects = [effect for effect in self.combo_effects if effect.update(frame_time)]
+        
+            # Update animal animations
+            self.animal_animations = [animal for animal in self.animal_animations if animal.update(frame_time)]
         
         # Check game over condition
         if self.health <= 0:
-            self.show_game_over()
+            if self.headless:
+                # No one to press R: end the run instead of blocking on the game over screen
+                self.running = False
+            else:
+                self.show_game_over()
     def calculate_grade(self):
         if self.total_notes == 0:
             return "N/A"
@@ -1008,17 +2362,19 @@ class RhythmGame:
         else:
             return "F"
     
-    def draw(self):
-        # Clear screen
-        self.screen.fill(BLACK)
+    def build_playfield(self):
+        # Render the static playfield (tracks, target line and hit buttons)
+        # once; it is only rebuilt when the window is resized
+        playfield = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+        playfield.fill(BLACK)
         
         # Draw tracks
         for i in range(TRACK_COUNT):
             x = (i + 1) * TRACK_WIDTH
-            pygame.draw.line(self.screen, GRAY, (x, 0), (x, SCREEN_HEIGHT), int(2 * SCALE_Y))
+            pygame.draw.line(playfield, GRAY, (x, 0), (x, SCREEN_HEIGHT), int(2 * SCALE_Y))
         
         # Draw target line
-        pygame.draw.line(self.screen, WHITE, (0, TARGET_Y), (SCREEN_WIDTH, TARGET_Y), int(3 * SCALE_Y))
+        pygame.draw.line(playfield, WHITE, (0, TARGET_Y), (SCREEN_WIDTH, TARGET_Y), int(3 * SCALE_Y))
         
         # Draw track hit buttons with clearer icons
         for i in range(TRACK_COUNT):
@@ -1027,62 +2383,62 @@ class RhythmGame:
             
             # Draw larger circle with fill and outline
             circle_radius = int(35 * SCALE_Y)
-            pygame.draw.circle(self.screen, color, (x, TARGET_Y), circle_radius)
-            pygame.draw.circle(self.screen, WHITE, (x, TARGET_Y), circle_radius, int(3 * SCALE_Y))
+            pygame.draw.circle(playfield, color, (x, TARGET_Y), circle_radius)
+            pygame.draw.circle(playfield, WHITE, (x, TARGET_Y), circle_radius, int(3 * SCALE_Y))
             
             # Draw custom icons instead of arrow text
             if i == 0:  # Up arrow
                 # Draw triangle pointing up
-                pygame.draw.polygon(self.screen, BLACK, [
+                pygame.draw.polygon(playfield, BLACK, [
                     (x, TARGET_Y - int(15 * SCALE_Y)),  # Top point
                     (x - int(12 * SCALE_X), TARGET_Y + int(5 * SCALE_Y)),  # Bottom left
                     (x + int(12 * SCALE_X), TARGET_Y + int(5 * SCALE_Y))   # Bottom right
                 ])
             elif i == 1:  # Down arrow
                 # Draw triangle pointing down
-                pygame.draw.polygon(self.screen, BLACK, [
+                pygame.draw.polygon(playfield, BLACK, [
                     (x, TARGET_Y + int(15 * SCALE_Y)),  # Bottom point
                     (x - int(12 * SCALE_X), TARGET_Y - int(5 * SCALE_Y)),  # Top left
                     (x + int(12 * SCALE_X), TARGET_Y - int(5 * SCALE_Y))   # Top right
                 ])
             elif i == 2:  # Right arrow
                 # Draw triangle pointing right
-                pygame.draw.polygon(self.screen, BLACK, [
+                pygame.draw.polygon(playfield, BLACK, [
                     (x + int(15 * SCALE_X), TARGET_Y),  # Right point
                     (x - int(5 * SCALE_X), TARGET_Y - int(12 * SCALE_Y)),  # Top left
                     (x - int(5 * SCALE_X), TARGET_Y + int(12 * SCALE_Y))   # Bottom left
                 ])
             elif i == 3:  # Left arrow
                 # Draw triangle pointing left
-                pygame.draw.polygon(self.screen, BLACK, [
+                pygame.draw.polygon(playfield, BLACK, [
                     (x - int(15 * SCALE_X), TARGET_Y),  # Left point
                     (x + int(5 * SCALE_X), TARGET_Y - int(12 * SCALE_Y)),  # Top right
                     (x + int(5 * SCALE_X), TARGET_Y + int(12 * SCALE_Y))   # Bottom right
                 ])
         
-        # Draw all notes
-        for note in self.notes:
-            note.draw(self.screen)
+        self.playfield = playfield
         
-        # Draw hit effects
-        for effect in self.hit_effects:
-            effect.draw(self.screen)
-            
-        # Draw combo effects
-        for effect in self.combo_effects:
-            effect.draw(self.screen)
-            
-        # Draw animal animations
-        for animal in self.animal_animations:
-            animal.draw(self.screen)
+        # Bake animal animations up front so perfect-streak bursts never bake mid-game
+        animal_frames.build()
+        
+        # Shared semi-transparent overlay for the level up and pause screens
+        self.dim_overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
+        self.dim_overlay.fill((0, 0, 0, 128))
+    
+    def draw_hud(self):
+        # Draw the HUD and return (field, key, rect) for each element, where
+        # key changes whenever the field's pixels would change
+        hud = []
         
         # Draw UI elements
-        score_text = self.font.render(f"Score: {self.score}", True, WHITE)
-        self.screen.blit(score_text, (int(10 * SCALE_X), int(10 * SCALE_Y)))
+        score_label = f"Score: {self.score}"
+        score_text = text_cache.render(score_label, self.font_size, WHITE)
+        hud.append(('score', score_label, self.screen.blit(score_text, (int(10 * SCALE_X), int(10 * SCALE_Y)))))
         
         # Draw level indicator
-        level_text = self.font.render(f"Level: {self.level}", True, ORANGE)
-        self.screen.blit(level_text, (int(10 * SCALE_X), int(50 * SCALE_Y)))
+        level_label = f"Level: {self.level}"
+        level_text = text_cache.render(level_label, self.font_size, ORANGE)
+        hud.append(('level', level_label, self.screen.blit(level_text, (int(10 * SCALE_X), int(50 * SCALE_Y)))))
         
         # Draw next level threshold
         if self.level < len(LEVEL_THRESHOLDS):
@@ -1092,75 +2448,197 @@ class RhythmGame:
             
             # Draw level progress bar
             bar_width = int(150 * SCALE_X)
-            pygame.draw.rect(self.screen, GRAY, (int(170 * SCALE_X), int(55 * SCALE_Y), bar_width, int(20 * SCALE_Y)), 1)
+            bar_rect = pygame.draw.rect(self.screen, GRAY, (int(170 * SCALE_X), int(55 * SCALE_Y), bar_width, int(20 * SCALE_Y)), 1)
             pygame.draw.rect(self.screen, ORANGE, (int(170 * SCALE_X), int(55 * SCALE_Y), int(bar_width * progress), int(20 * SCALE_Y)))
+            hud.append(('level_bar', int(bar_width * progress), bar_rect))
         
-        combo_text = self.font.render(f"Combo: {self.combo}", True, WHITE)
-        self.screen.blit(combo_text, (int(10 * SCALE_X), int(90 * SCALE_Y)))
+        combo_label = f"Combo: {self.combo}"
+        combo_text = text_cache.render(combo_label, self.font_size, WHITE)
+        hud.append(('combo', combo_label, self.screen.blit(combo_text, (int(10 * SCALE_X), int(90 * SCALE_Y)))))
         
         # Draw difficulty indicator
         difficulty_color = GREEN if self.difficulty == 'easy' else YELLOW if self.difficulty == 'normal' else RED
-        difficulty_text = self.font.render(f"Difficulty: {self.difficulty.upper()}", True, difficulty_color)
-        self.screen.blit(difficulty_text, (int(10 * SCALE_X), int(130 * SCALE_Y)))
+        difficulty_label = f"Difficulty: {self.difficulty.upper()}"
+        difficulty_text = text_cache.render(difficulty_label, self.font_size, difficulty_color)
+        hud.append(('difficulty', difficulty_label, self.screen.blit(difficulty_text, (int(10 * SCALE_X), int(130 * SCALE_Y)))))
         
         # Draw perfect streak if active
         if self.perfect_streak >= 3:
-            streak_text = self.font.render(f"Perfect Streak: {self.perfect_streak}", True, PURPLE)
-            self.screen.blit(streak_text, (int(10 * SCALE_X), int(170 * SCALE_Y)))
+            streak_label = f"Perfect Streak: {self.perfect_streak}"
+            streak_text = text_cache.render(streak_label, self.font_size, PURPLE)
+            hud.append(('streak', streak_label, self.screen.blit(streak_text, (int(10 * SCALE_X), int(170 * SCALE_Y)))))
         
         # Draw health bar
         health_bar_width = int(200 * SCALE_X)
         health_bar_height = int(20 * SCALE_Y)
         health_bar_x = SCREEN_WIDTH - int(210 * SCALE_X)
-        pygame.draw.rect(self.screen, RED, (health_bar_x, int(10 * SCALE_Y), health_bar_width, health_bar_height), 1)
+        health_rect = pygame.draw.rect(self.screen, RED, (health_bar_x, int(10 * SCALE_Y), health_bar_width, health_bar_height), 1)
         pygame.draw.rect(self.screen, RED, (health_bar_x, int(10 * SCALE_Y), int(self.health * health_bar_width / 100), health_bar_height))
+        hud.append(('health', int(self.health * health_bar_width / 100), health_rect))
         
         # Draw current grade
         grade = self.calculate_grade()
-        grade_text = self.font.render(f"Grade: {grade}", True, WHITE)
-        self.screen.blit(grade_text, (SCREEN_WIDTH - int(100 * SCALE_X), int(40 * SCALE_Y)))
+        grade_text = text_cache.render(f"Grade: {grade}", self.font_size, WHITE)
+        hud.append(('grade', grade, self.screen.blit(grade_text, (SCREEN_WIDTH - int(100 * SCALE_X), int(40 * SCALE_Y)))))
+        
+        return hud
+    
+    def draw(self):
+        # Full-screen overlays and freshly built caches need a full redraw;
+        # otherwise dirty-rect mode only repaints what changed
+        full_redraw = (not self.dirty_rects or self.playfield is None or self.needs_full_redraw
+                       or self.paused or self.show_level_up or self.show_profiler)
+        
+        # Clear screen and draw the cached static playfield in one blit
+        with self.profiler.phase('draw.background'):
+            if self.playfield is None:
+                self.build_playfield()
+            if full_redraw:
+                self.screen.blit(self.playfield, (0, 0))
+            else:
+                # Restore the background under everything drawn last frame
+                for rect in self.drawn_rects:
+                    self.screen.blit(self.playfield, rect, rect)
+        
+        # Draw all notes from the sprite atlas in one batch
+        with self.profiler.phase('draw.notes'):
+            dynamic_rects = note_atlas.draw(self.screen, self.notes.draw_items(), doreturn=True)
+        
+        with self.profiler.phase('draw.effects'):
+            # Draw hit effects
+            for effect in self.hit_effects:
+                dynamic_rects.append(effect.draw(self.screen))
+            
+            # Draw combo effects
+            for effect in self.combo_effects:
+                dynamic_rects.append(effect.draw(self.screen))
+            
+            # Draw animal animations
+            for animal in self.animal_animations:
+                dynamic_rects.append(animal.draw(self.screen))
+        
+        with self.profiler.phase('draw.hud'):
+            hud = self.draw_hud()
         
         # Draw level up effect if active
         if self.show_level_up:
-            # Create semi-transparent overlay
-            overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-            overlay.fill((0, 0, 0, 128))
-            self.screen.blit(overlay, (0, 0))
+            # Semi-transparent overlay
+            self.screen.blit(self.dim_overlay, (0, 0))
             
             # Draw level up text with pulsating effect
-            pulse = 1.0 + 0.2 * math.sin(time.time() * 10)
-            level_font = pygame.font.SysFont(None, int(72 * pulse))
-            level_up_text = level_font.render(f"LEVEL UP! {self.level-1} → {self.level}", True, ORANGE)
+            pulse = 1.0 + 0.2 * math.sin(self.elapsed_time * 10)
+            level_up_text = text_cache.render(f"LEVEL UP! {self.level-1} → {self.level}", int(72 * pulse), ORANGE)
             level_up_rect = level_up_text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
             self.screen.blit(level_up_text, level_up_rect)
             
             # Draw bonus info
-            bonus_font = pygame.font.SysFont(None, 36)
-            bonus_text = bonus_font.render(f"Score Multiplier: +{(self.level-1)*10}%", True, YELLOW)
+            bonus_text = text_cache.render(f"Score Multiplier: +{(self.level-1)*10}%", 36, YELLOW)
             bonus_rect = bonus_text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 50))
             self.screen.blit(bonus_text, bonus_rect)
         
         # Draw pause indicator if paused
         if self.paused:
-            pause_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-            pause_surface.fill((0, 0, 0, 128))  # Semi-transparent black
-            self.screen.blit(pause_surface, (0, 0))
+            self.screen.blit(self.dim_overlay, (0, 0))  # Semi-transparent black
             
-            pause_text = self.font.render("PAUSED", True, WHITE)
+            pause_text = text_cache.render("PAUSED", self.font_size, WHITE)
             self.screen.blit(pause_text, (SCREEN_WIDTH // 2 - pause_text.get_width() // 2, SCREEN_HEIGHT // 2))
             
-            controls_text = self.font.render("Press ESC to resume, 1-2-3 to change difficulty", True, WHITE)
+            controls_text = text_cache.render("ESC: resume, 1-2-3: difficulty, C: calibrate", self.font_size, WHITE)
             self.screen.blit(controls_text, (SCREEN_WIDTH // 2 - controls_text.get_width() // 2, SCREEN_HEIGHT // 2 + 40))
             
-            key_text = self.font.render("Controls: ↑ ↓ → ←", True, WHITE)
+            key_text = text_cache.render("Controls: ↑ ↓ → ←", self.font_size, WHITE)
             self.screen.blit(key_text, (SCREEN_WIDTH // 2 - key_text.get_width() // 2, SCREEN_HEIGHT // 2 + 80))
         
-        # Update display
-        pygame.display.flip()
-    def show_game_over(self):
+        if self.show_profiler:
+            self.profiler.draw(self.screen)
+        
+        self.input_sampler.poll()  # Presenting can block on vsync
+        with self.profiler.phase('draw.present'):
+            # Update display
+            if full_redraw:
+                pygame.display.flip()
+                # Repaint fully once more after an overlay closes
+                self.needs_full_redraw = self.paused or self.show_level_up or self.show_profiler
+            else:
+                # Push only moving elements (old and new positions) and HUD
+                # fields whose contents changed or that a moving element touched
+                update_rects = self.dynamic_rects + dynamic_rects
+                for field, key, rect in hud:
+                    previous = self.hud_state.get(field)
+                    if previous is None or previous[0] != key:
+                        update_rects.append(rect)
+                        if previous is not None:
+                            update_rects.append(previous[1])
+                    elif rect.collidelist(update_rects) != -1:
+                        update_rects.append(rect)
+                current_fields = {field for field, _, _ in hud}
+                for field, (key, rect) in self.hud_state.items():
+                    if field not in current_fields:
+                        update_rects.append(rect)  # Field disappeared (e.g. streak lost)
+                pygame.display.update(update_rects)
+        
+        self.dynamic_rects = dynamic_rects
+        self.hud_state = {field: (key, rect) for field, key, rect in hud}
+        self.drawn_rects = dynamic_rects + [rect for _, _, rect in hud]
+    def finish_chart(self):
+        # The chart ran out and every note has been judged
+        if self.headless:
+            self.running = False
+        else:
+            self.show_game_over(title="CHART COMPLETE", title_color=GREEN, sound='level_up')
+    
+    def replay_result(self):
+        return {
+            'score': self.score,
+            'max_combo': self.max_combo,
+            'perfect': self.perfect_hits,
+            'good': self.good_hits,
+            'misses': self.misses,
+            'grade': self.calculate_grade()
+        }
+    
+    def save_replay(self):
+        # Write the session's replay, once, when the session ends
+        if self.recorder is None or not self.recorder.log:
+            return None
+        try:
+            os.makedirs(self.replay_dir, exist_ok=True)
+            path = os.path.join(self.replay_dir, time.strftime("replay_%Y%m%d_%H%M%S_") + f"{self.recorder.seed:016x}.rgr")
+            self.recorder.save(path, self.replay_result())
+            print(f"Replay saved to {path}")
+        except OSError as e:
+            print(f"Error saving replay: {e}")
+            path = None
+        self.recorder = None
+        return path
+    
+    def draw_leaderboard(self, fade_in=1.0):
+        # Top scores for this difficulty, from the score writer's memory cache
+        size = int(24 * SCALE_Y)
+        lines = [f"TOP {LEADERBOARD_SIZE} - {self.difficulty.upper()}"]
+        for rank, entry in enumerate(self.score_writer.top(self.difficulty), 1):
+            lines.append(f"{rank}. {entry['name']}  {entry['score']}")
+        height = size * len(lines) + 8
+        rect = pygame.Rect(int(10 * SCALE_X), SCREEN_HEIGHT - height - int(10 * SCALE_Y), int(200 * SCALE_X), height)
+        self.screen.fill(BLACK, rect)
+        for row, line in enumerate(lines):
+            text = effect_sprites.fade(line, size, YELLOW if row == 0 else WHITE, fade_in)
+            self.screen.blit(text, (rect.x + 4, rect.y + 4 + row * size))
+        return rect
+    
+    def show_game_over(self, title="GAME OVER", title_color=RED, sound='game_over'):
+        self.save_replay()
+        
+        # Queue the run for saving; the leaderboard below is read from memory
+        if self.score_writer is not None:
+            accuracy = (self.notes_hit / self.total_notes) * 100 if self.total_notes else 0.0
+            self.score_writer.save(PLAYER_NAME, self.score, self.difficulty, self.max_combo, round(accuracy, 1))
+        leaderboard_version = None
+        if self.song is not None:
+            self.song.stop()
+        
         # Play game over sound
-        if 'game_over' in self.sound_effects:
-            self.sound_effects['game_over'].play()
+        self.sound_pool.play(sound)
             
         # Create animated game over sequence
         animation_frames = 60
@@ -1178,10 +2656,10 @@ class RhythmGame:
             overlay.fill(bg_color + (100,))  # Add alpha
             self.screen.blit(overlay, (0, 0))
             
-            # Animate "GAME OVER" text growing from center
+            # Animate the title text growing from center
             size_factor = 0.1 + 2.9 * min(1.0, progress * 2)  # Grow to full size by halfway
-            game_over_font = pygame.font.SysFont(None, int(100 * size_factor))
-            game_over_text = game_over_font.render("GAME OVER", True, RED)
+            game_over_font = text_cache.get_font(int(100 * size_factor))
+            game_over_text = game_over_font.render(title, True, title_color)
             game_over_rect = game_over_text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 140))
             self.screen.blit(game_over_text, game_over_rect)
             
@@ -1217,7 +2695,7 @@ class RhythmGame:
                 
                 # Make grade text larger and animated
                 grade_pulse = 1.0 + 0.2 * math.sin(frame / 3)
-                grade_font = pygame.font.SysFont(None, int(72 * grade_pulse))
+                grade_font = text_cache.get_font(int(72 * grade_pulse))
                 grade_text = grade_font.render(f"Grade: {grade}", True, grade_color)
                 
                 # Display hit statistics
@@ -1251,6 +2729,10 @@ class RhythmGame:
                 
                 self.screen.blit(stats_text, (SCREEN_WIDTH // 2 - stats_text.get_width() // 2, SCREEN_HEIGHT // 2 + 160))
                 self.screen.blit(restart_text, (SCREEN_WIDTH // 2 - restart_text.get_width() // 2, SCREEN_HEIGHT // 2 + 200))
+                
+                if self.score_writer is not None:
+                    leaderboard_version = self.score_writer.version
+                    self.draw_leaderboard(fade_in)
             
             # Update display
             pygame.display.flip()
@@ -1268,71 +2750,539 @@ class RhythmGame:
         # After animation, wait for restart or quit
         waiting = True
         while waiting:
+            # Repaint the leaderboard when the score writer refreshes it
+            if self.score_writer is not None and self.score_writer.version != leaderboard_version:
+                leaderboard_version = self.score_writer.version
+                pygame.display.update(self.draw_leaderboard())
+            
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     pygame.quit()
                     sys.exit()
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_r:
-                        self.__init__()  # Reset the game
+                        self.reset_session()  # Reset the game
                         waiting = False
                     elif event.key == pygame.K_ESCAPE:
                         pygame.quit()
                         sys.exit()
             self.clock.tick(FPS)
     
-    def run(self):
-        while self.running:
-            self.clock.tick(FPS)
-            self.handle_input()
-            self.update()
-            self.draw()
+    def calibrate(self):
+        # Two rounds of SPACE taps. Following a metronome that can only be
+        # heard measures audio + input latency; following a flash that can
+        # only be seen measures input latency. The difference is the audio
+        # latency.
+        heard = self.calibration_round(audible=True)
+        seen = self.calibration_round(audible=False) if heard is not None else None
+        if seen is not None:
+            self.settings['input_offset_ms'] = round(seen, 1)
+            self.settings['audio_offset_ms'] = round(heard - seen, 1)
+            save_settings(self.settings)
+            self.apply_offsets()
+            print(f"Calibrated: audio offset {self.settings['audio_offset_ms']} ms, "
+                  f"input offset {self.settings['input_offset_ms']} ms")
         
+        # Don't count the time spent here as game time
+        self.last_update_time = self.time_source()
+        self.needs_full_redraw = True
+    
+    def calibration_round(self, audible):
+        # Returns the median tap error in milliseconds, or None if cancelled
+        # or too few taps landed near a beat
+        start = self.time_source() + 1.0
+        beats = [start + i * CALIBRATION_INTERVAL for i in range(CALIBRATION_BEATS)]
+        end = beats[-1] + CALIBRATION_INTERVAL
+        next_beat = 0
+        flash_until = 0
+        taps = []
+        while True:
+            now = self.time_source()
+            if now >= end:
+                break
+            while next_beat < len(beats) and beats[next_beat] <= now:
+                if audible:
+                    self.sound_pool.play('tick')
+                else:
+                    flash_until = beats[next_beat] + 0.1
+                next_beat += 1
+            
+            self.input_sampler.poll()
+            for event, timestamp in self.input_sampler.drain():
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE:
+                        return None
+                    if event.key == pygame.K_SPACE:
+                        taps.append(timestamp)
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    sys.exit()
+            
+            self.screen.fill(BLACK)
+            title = "Tap SPACE to the clicks" if audible else "Tap SPACE to the flashes"
+            title_text = text_cache.render(title, self.font_size, WHITE)
+            self.screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, SCREEN_HEIGHT // 3))
+            progress_text = text_cache.render(f"{min(next_beat, CALIBRATION_BEATS)} / {CALIBRATION_BEATS}   (ESC to cancel)",
+                                              int(24 * SCALE_Y), GRAY if audible else WHITE)
+            self.screen.blit(progress_text, (SCREEN_WIDTH // 2 - progress_text.get_width() // 2, SCREEN_HEIGHT // 3 + self.font_size))
+            radius = int(40 * SCALE_Y)
+            color = WHITE if now < flash_until else GRAY
+            pygame.draw.circle(self.screen, color, (SCREEN_WIDTH // 2, TARGET_Y), radius)
+            pygame.display.flip()
+            self.input_sampler.wait_frame(FPS)
+        
+        # Error of each tap against its nearest beat, ignoring warm-up beats
+        # and taps that belong to no beat
+        errors = []
+        for tap in taps:
+            beat = min(beats, key=lambda b: abs(tap - b))
+            if beat >= beats[CALIBRATION_WARMUP] and abs(tap - beat) < CALIBRATION_INTERVAL / 2:
+                errors.append((tap - beat) * 1000)
+        if len(errors) < (CALIBRATION_BEATS - CALIBRATION_WARMUP) // 2:
+            return None
+        errors.sort()
+        return percentile(errors, 0.5)
+    
+    def run(self):
+        try:
+            while self.running:
+                with self.profiler.phase('wait'):
+                    self.input_sampler.wait_frame(FPS)
+                with self.profiler.phase('input'):
+                    self.handle_input()
+                with self.profiler.phase('update'):
+                    self.update()
+                self.input_sampler.poll()
+                with self.profiler.phase('draw'):
+                    self.draw()
+                self.profiler.end_frame(notes=len(self.notes), effects=len(self.hit_effects) + len(self.combo_effects),
+                                        animals=len(self.animal_animations))
+        finally:
+            # Also reached when the game over screen exits the process
+            self.save_replay()
+            if self.score_writer is not None:
+                self.score_writer.close()
+            if self.profile_path:
+                self.profiler.export(self.profile_path)
+                print(f"Frame trace written to {self.profile_path}")
+        stats = text_cache.stats()
+        print(f"Text cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.1%} hit rate), {stats['font_misses']} fonts created")
+        stats = self.sound_pool.stats()
+        print(f"Sound voices: {stats['played']} played, {stats['stolen']} stolen, "
+              f"{stats['dropped']} dropped ({stats['voices']} channels)")
         pygame.quit()
 
-# Run the game
-if __name__ == "__main__":
-    game = RhythmGame()
-    game.run()
 # High score management functions
+class ScoreStore:
+    # Full score history in SQLite. Each insert is one transaction and the
+    # WAL journal keeps the board intact if the process dies mid-write.
+    # Indexes serve the top scores per difficulty, a player's history and
+    # date ranges, so inserts and queries stay O(log n) as runs pile up.
+    # The connection may be used from any thread; a lock serializes access.
+    COLUMNS = ('name', 'score', 'difficulty', 'max_combo', 'accuracy', 'date')
+    
+    def __init__(self, path=SCORES_DB_FILE, legacy_path=HIGH_SCORES_FILE):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] < SCORES_SCHEMA_VERSION:
+            self.create(legacy_path)
+    
+    def create(self, legacy_path):
+        # Schema and the one-time JSON import commit together
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS scores (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    score INTEGER NOT NULL,
+                    difficulty TEXT NOT NULL,
+                    max_combo INTEGER NOT NULL,
+                    accuracy REAL NOT NULL,
+                    date TEXT NOT NULL
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS scores_by_score ON scores (score DESC)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS scores_by_difficulty ON scores (difficulty, score DESC)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS scores_by_name ON scores (name, date)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS scores_by_date ON scores (date)")
+            if legacy_path and os.path.exists(legacy_path):
+                try:
+                    with open(legacy_path, 'r') as f:
+                        legacy = json.load(f)
+                    self.connection.executemany(
+                        "INSERT INTO scores (name, score, difficulty, max_combo, accuracy, date) VALUES (?, ?, ?, ?, ?, ?)",
+                        [tuple(entry[column] for column in self.COLUMNS) for entry in legacy])
+                    print(f"Imported {len(legacy)} high scores from {legacy_path}")
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    print(f"Error importing high scores: {e}")
+            self.connection.execute(f"PRAGMA user_version = {SCORES_SCHEMA_VERSION}")
+    
+    def add(self, name, score, difficulty, max_combo, accuracy, date=None):
+        self.add_many([{'name': name, 'score': score, 'difficulty': difficulty, 'max_combo': max_combo,
+                        'accuracy': accuracy, 'date': date or time.strftime("%Y-%m-%d %H:%M")}])
+    
+    def add_many(self, entries):
+        """Insert score dicts in a single transaction"""
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO scores (name, score, difficulty, max_combo, accuracy, date) VALUES (?, ?, ?, ?, ?, ?)",
+                [tuple(entry[column] for column in self.COLUMNS) for entry in entries])
+    
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, parameters)]
+    
+    def top(self, limit=5, difficulty=None):
+        """Highest scores, overall or for one difficulty"""
+        columns = ", ".join(self.COLUMNS)
+        if difficulty is None:
+            return self.query(f"SELECT {columns} FROM scores ORDER BY score DESC LIMIT ?", (limit,))
+        return self.query(f"SELECT {columns} FROM scores WHERE difficulty = ? ORDER BY score DESC LIMIT ?",
+                          (difficulty, limit))
+    
+    def player(self, name, limit=50):
+        """A player's most recent runs"""
+        return self.query(f"SELECT {', '.join(self.COLUMNS)} FROM scores WHERE name = ? ORDER BY date DESC LIMIT ?",
+                          (name, limit))
+    
+    def between(self, start, end, limit=50):
+        """Best runs dated from `start` up to (not including) `end`, as "YYYY-MM-DD[ HH:MM]" strings"""
+        return self.query(f"SELECT {', '.join(self.COLUMNS)} FROM scores WHERE date >= ? AND date < ? "
+                          "ORDER BY score DESC LIMIT ?", (start, end, limit))
+    
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+    
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class ScoreWriter:
+    # Saves scores on a background thread so a slow disk never stalls a
+    # frame. Scores that queue up while a write is in progress are
+    # committed together in one transaction. The worker keeps an in-memory
+    # leaderboard per difficulty warm, so the results screen never reads
+    # the disk.
+    def __init__(self, path=SCORES_DB_FILE):
+        self.path = path
+        self.queue = queue.Queue(maxsize=PERSIST_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.leaderboards = {}  # Difficulty -> top LEADERBOARD_SIZE score dicts
+        self.version = 0  # Bumped whenever the leaderboards change
+        self.thread = threading.Thread(target=self.run, name="score-writer", daemon=True)
+        self.thread.start()
+    
+    def save(self, name, score, difficulty, max_combo, accuracy):
+        entry = {'name': name, 'score': score, 'difficulty': difficulty, 'max_combo': max_combo,
+                 'accuracy': accuracy, 'date': time.strftime("%Y-%m-%d %H:%M")}
+        # Show the run straight away; the worker replaces this with the stored board
+        with self.lock:
+            board = self.leaderboards.get(difficulty, []) + [entry]
+            board.sort(key=lambda x: x['score'], reverse=True)
+            self.leaderboards[difficulty] = board[:LEADERBOARD_SIZE]
+            self.version += 1
+        self.queue.put(entry)  # Only blocks if PERSIST_QUEUE_SIZE writes are stuck behind the disk
+    
+    def top(self, difficulty):
+        with self.lock:
+            return list(self.leaderboards.get(difficulty, []))
+    
+    def run(self):
+        # SQLite connections belong to the thread that opens them
+        try:
+            store = ScoreStore(self.path)
+            self.refresh(store)
+        except Exception as e:
+            print(f"Error opening high scores: {e}")
+            store = None
+        
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            entries = [entry for entry in batch if entry is not None]
+            if entries and store is not None:
+                try:
+                    store.add_many(entries)
+                    self.refresh(store)
+                except Exception as e:
+                    print(f"Error saving high scores: {e}")
+            if None in batch:
+                # Shutdown: everything queued before it has been committed
+                if store is not None:
+                    store.close()
+                return
+    
+    def refresh(self, store):
+        leaderboards = {difficulty: store.top(LEADERBOARD_SIZE, difficulty) for difficulty in DIFFICULTY_SETTINGS}
+        with self.lock:
+            self.leaderboards = leaderboards
+            self.version += 1
+    
+    def close(self, timeout=5.0):
+        """Commit every queued score and stop the worker"""
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+
+_score_store = None
+_score_store_lock = threading.Lock()
+
+def get_score_store():
+    """The shared ScoreStore, opened on first use; safe to call from any thread"""
+    global _score_store
+    with _score_store_lock:
+        if _score_store is None:
+            _score_store = ScoreStore()
+    return _score_store
+
 def load_high_scores():
-    """Load high scores from file"""
+    """Load the top 5 high scores"""
     try:
-        if os.path.exists(HIGH_SCORES_FILE):
-            with open(HIGH_SCORES_FILE, 'r') as f:
-                return json.load(f)
-        else:
-            return []
+        return get_score_store().top(5)
     except Exception as e:
         print(f"Error loading high scores: {e}")
         return []
 
 def save_high_score(name, score, difficulty, max_combo, accuracy):
-    """Save a new high score"""
+    """Save a new high score and return the top 5"""
     try:
-        scores = load_high_scores()
-        
-        # Add new score
-        new_score = {
-            'name': name,
-            'score': score,
-            'difficulty': difficulty,
-            'max_combo': max_combo,
-            'accuracy': accuracy,
-            'date': time.strftime("%Y-%m-%d %H:%M")
-        }
-        
-        scores.append(new_score)
-        
-        # Sort by score (highest first) and keep only top 5
-        scores.sort(key=lambda x: x['score'], reverse=True)
-        scores = scores[:5]
-        
-        # Save to file
-        with open(HIGH_SCORES_FILE, 'w') as f:
-            json.dump(scores, f)
-            
-        return scores
+        store = get_score_store()
+        store.add(name, score, difficulty, max_combo, accuracy)
+        return store.top(5)
     except Exception as e:
         print(f"Error saving high score: {e}")
         return []
+
+def load_settings():
+    """Load player settings, filling in defaults"""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        if os.path.exists(SETTINGS_FILE):
+            with open(SETTINGS_FILE, 'r') as f:
+                settings.update(json.load(f))
+    except Exception as e:
+        print(f"Error loading settings: {e}")
+    return settings
+
+def save_settings(settings):
+    """Save player settings"""
+    try:
+        with open(SETTINGS_FILE, 'w') as f:
+            json.dump(settings, f)
+    except Exception as e:
+        print(f"Error saving settings: {e}")
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(math.ceil(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_benchmark(seconds=30, fps=FPS, seed=0, note_engine='lanes', dirty_rects=False, accuracy=0.9):
+    """Drive update()/draw() for `seconds` of simulated time at every difficulty and report frame times"""
+    results = {}
+    for difficulty in DIFFICULTY_PROGRESSION:
+        clock = SimulatedClock()
+        rng = random.Random(seed)
+        startup(headless=True)
+        game = RhythmGame(note_engine=note_engine, dirty_rects=dirty_rects, time_source=clock,
+                          rng=rng, headless=True, settings=dict(DEFAULT_SETTINGS))
+        game.difficulty = difficulty
+        game.apply_difficulty_settings()
+        
+        # A separate RNG for the autoplayer keeps the chart identical across settings
+        player = random.Random(seed + 1)
+        skipped = set()  # (track, hit_time) of notes the autoplayer chose to miss
+        update_times = []
+        draw_times = []
+        frame_times = []
+        for _ in range(int(seconds * fps)):
+            clock.advance(1.0 / fps)
+            
+            # Autoplay: press each lane's note exactly on time, missing some on purpose
+            now = game.game_time_at(clock())
+            for track in range(TRACK_COUNT):
+                note = game.notes.nearest(track, now)
+                if note is not None and note.hit_time <= now and (track, note.hit_time) not in skipped:
+                    if player.random() < accuracy:
+                        game.check_note_hit(track, note.hit_time)
+                    else:
+                        skipped.add((track, note.hit_time))
+            
+            start = time.perf_counter()
+            game.update()
+            middle = time.perf_counter()
+            game.draw()
+            end = time.perf_counter()
+            update_times.append((middle - start) * 1000)
+            draw_times.append((end - middle) * 1000)
+            frame_times.append((end - start) * 1000)
+            if not game.running:
+                break
+        
+        result = {'frames': len(frame_times), 'notes': game.total_notes, 'score': game.score}
+        for name, samples in (('update', update_times), ('draw', draw_times), ('frame', frame_times)):
+            samples.sort()
+            for label, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99), ('max', 1.0)):
+                result[f"{name}_{label}"] = percentile(samples, fraction)
+        results[difficulty] = result
+    return results
+
+
+def load_replay(path):
+    """Read and validate a replay file into its header fields, recorded result and (kind, seconds, argument) records"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < REPLAY_HEADER.size:
+        raise ValueError("truncated header")
+    (magic, version, seed, width, height, chart_start, start_us, digest, record_count,
+     path_length) = REPLAY_HEADER.unpack_from(data)
+    if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+        raise ValueError("not a supported replay")
+    if not (0 < width <= REPLAY_MAX_DIMENSION and 0 < height <= REPLAY_MAX_DIMENSION):
+        raise ValueError(f"invalid resolution {width}x{height}")
+    if not 0 <= chart_start < float('inf'):
+        raise ValueError(f"invalid chart start {chart_start}")
+    offset = REPLAY_HEADER.size
+    if len(data) < offset + path_length + REPLAY_RESULT.size:
+        raise ValueError("truncated header")
+    chart_path = data[offset:offset + path_length].decode('utf-8') or None
+    offset += path_length
+    score, max_combo, perfect, good, misses, grade = REPLAY_RESULT.unpack_from(data, offset)
+    
+    # Never inflate more than the header says the log holds
+    expected = record_count * REPLAY_RECORD.size
+    decompressor = zlib.decompressobj()
+    try:
+        log = decompressor.decompress(data[offset + REPLAY_RESULT.size:], expected + 1)
+    except zlib.error as e:
+        raise ValueError(f"corrupt record log ({e})")
+    if len(log) != expected or not decompressor.eof or decompressor.unused_data:
+        raise ValueError(f"record log does not hold the {record_count} records in the header")
+    
+    records = []
+    us = start_us
+    for kind, delta, argument in REPLAY_RECORD.iter_unpack(log):
+        if kind > REPLAY_RESIZE:
+            raise ValueError(f"record {len(records)}: unknown kind {kind}")
+        if kind == REPLAY_RESIZE and not (0 < argument >> 16 <= REPLAY_MAX_DIMENSION and
+                                          0 < argument & 0xFFFF <= REPLAY_MAX_DIMENSION):
+            raise ValueError(f"record {len(records)}: invalid resize {argument >> 16}x{argument & 0xFFFF}")
+        us += delta
+        records.append((kind, us / 1e6, argument))
+    return {
+        'seed': seed,
+        'width': width,
+        'height': height,
+        'chart_path': chart_path,
+        'chart_start': chart_start,
+        'chart_digest': digest,
+        'result': {'score': score, 'max_combo': max_combo, 'perfect': perfect, 'good': good,
+                   'misses': misses, 'grade': grade.rstrip(b'\0').decode('ascii')},
+        'records': records
+    }
+
+
+def simulate_replay(replay):
+    """Re-run a loaded replay headlessly through step()/press() and return the result it produces"""
+    # Only re-simulate on the exact chart the replay was played on
+    if replay['chart_path'] is not None and chart_digest(replay['chart_path']) != replay['chart_digest']:
+        raise ValueError(f"chart {replay['chart_path']} does not match the one the replay was recorded on")
+    startup(headless=True)
+    configure_resolution(replay['width'], replay['height'])
+    game = RhythmGame(time_source=SimulatedClock(), rng=random.Random(replay['seed']), headless=True,
+                      chart_path=replay['chart_path'], chart_start=replay['chart_start'],
+                      settings=dict(DEFAULT_SETTINGS))
+    previous = game.elapsed_time
+    for kind, seconds, argument in replay['records']:
+        if kind == REPLAY_FRAME:
+            game.step(seconds, seconds - previous)
+            previous = seconds
+        elif kind == REPLAY_KEY:
+            game.press(argument, seconds)
+        elif kind == REPLAY_AUDIO_OFFSET:
+            game.settings['audio_offset_ms'] = argument / 1000
+            game.apply_offsets()
+        elif kind == REPLAY_INPUT_OFFSET:
+            game.settings['input_offset_ms'] = argument / 1000
+            game.apply_offsets()
+        elif kind == REPLAY_RESIZE:
+            game.resize(argument >> 16, argument & 0xFFFF)
+    return game.replay_result()
+
+
+def verify_replay(path):
+    """Re-simulate a replay file; returns (matches its recorded result, simulated result)"""
+    replay = load_replay(path)
+    result = simulate_replay(replay)
+    return result == replay['result'], result
+
+
+def print_benchmark(results):
+    print(f"{'difficulty':<10} {'frames':>7} {'notes':>6} "
+          f"{'upd p50':>8} {'upd p99':>8} {'draw p50':>9} {'draw p99':>9} "
+          f"{'frame p50':>10} {'frame p95':>10} {'frame p99':>10} {'max':>8}  (ms)")
+    for difficulty, r in results.items():
+        print(f"{difficulty:<10} {r['frames']:>7} {r['notes']:>6} "
+              f"{r['update_p50']:>8.3f} {r['update_p99']:>8.3f} {r['draw_p50']:>9.3f} {r['draw_p99']:>9.3f} "
+              f"{r['frame_p50']:>10.3f} {r['frame_p95']:>10.3f} {r['frame_p99']:>10.3f} {r['frame_max']:>8.3f}")
+
+
+# Run the game
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Rhythm Master")
+    parser.add_argument("--headless", action="store_true", help="use SDL dummy video/audio drivers")
+    parser.add_argument("--benchmark", type=float, metavar="SECONDS",
+                        help="simulate SECONDS of play at every difficulty and report frame times")
+    parser.add_argument("--seed", type=int, default=0, help="RNG seed for benchmark runs")
+    parser.add_argument("--note-engine", choices=sorted(NOTE_ENGINES), default='lanes')
+    parser.add_argument("--dirty-rects", action="store_true", help="only repaint and push changed regions")
+    parser.add_argument("--chart", metavar="PATH", help="play an authored chart (text or binary) instead of random notes")
+    parser.add_argument("--start", type=float, default=0.0, metavar="SECONDS",
+                        help="practice: start the chart at SECONDS")
+    parser.add_argument("--music", metavar="PATH", help="backing track (ogg/mp3/wav) that drives note timing")
+    parser.add_argument("--calibrate", action="store_true", help="measure audio/input latency before playing")
+    parser.add_argument("--profile", metavar="PATH", help="write per-frame phase timings to PATH (.csv or .json) on exit")
+    parser.add_argument("--record", metavar="DIR", help="save a replay of every session to DIR")
+    parser.add_argument("--verify-replay", nargs='+', metavar="PATH",
+                        help="re-simulate replays headlessly and check their recorded results")
+    args = parser.parse_args()
+    startup(headless=args.headless or bool(args.benchmark) or bool(args.verify_replay) or HEADLESS)
+    
+    if args.verify_replay:
+        for path in args.verify_replay:
+            start = time.perf_counter()
+            # One bad submission must not stop the rest of the batch
+            try:
+                matches, result = verify_replay(path)
+            except Exception as e:
+                print(f"INVALID {path}: {e}")
+                continue
+            print(f"{'OK' if matches else 'MISMATCH'}  {path}  score {result['score']} max combo {result['max_combo']} "
+                  f"grade {result['grade']} ({time.perf_counter() - start:.2f} s)")
+        pygame.quit()
+    elif args.benchmark:
+        print_benchmark(run_benchmark(args.benchmark, seed=args.seed, note_engine=args.note_engine,
+                                      dirty_rects=args.dirty_rects))
+        pygame.quit()
+    else:
+        game = RhythmGame(note_engine=args.note_engine, dirty_rects=args.dirty_rects, chart_path=args.chart,
+                          chart_start=args.start, music_path=args.music, profile_path=args.profile,
+                          replay_dir=args.record)
+        if args.calibrate:
+            game.calibrate()
+        game.run()
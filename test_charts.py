@@ -0,0 +1,96 @@
+import pytest
+
+import rhythm_game as rg
+
+
+def sample_notes():
+    # A chord, a hold and notes either side of second boundaries
+    return [
+        rg.ChartNote(0.0, 0, 'normal', 0.0),
+        rg.ChartNote(0.999, 1, 'special', 0.0),
+        rg.ChartNote(1.0, 2, 'hold', 0.75),
+        rg.ChartNote(1.0, 3, 'normal', 0.0),
+        rg.ChartNote(2.5, 0, 'normal', 0.0),
+        rg.ChartNote(4.0, 1, 'hold', 65.535),
+    ]
+
+
+def write_records(path, records):
+    with open(path, 'wb') as f:
+        f.write(rg.CHART_HEADER.pack(rg.CHART_MAGIC, rg.CHART_VERSION, 0, len(records)))
+        for record in records:
+            f.write(rg.CHART_RECORD.pack(*record))
+
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_write_chart_round_trip(tmp_path, binary):
+    path = tmp_path / 'chart.rgc'
+    notes = sample_notes()
+    rg.write_chart(path, notes[4:] + notes[:4], binary=binary)  # Sorted on write; the chord keeps its order
+    assert list(rg.iter_chart(path)) == sample_notes()
+    reader = rg.iter_binary_chart if binary else rg.iter_text_chart
+    assert list(reader(path)) == sample_notes()
+
+
+def test_iter_chart_start(tmp_path):
+    path = tmp_path / 'chart.rgc'
+    rg.write_chart(path, sample_notes())
+    assert [note.time for note in rg.iter_chart(path, 1.0)] == [1.0, 1.0, 2.5, 4.0]
+
+
+def test_text_chart_rejects_backwards_times(tmp_path):
+    path = tmp_path / 'chart.txt'
+    path.write_text("0 0 normal\n500 1 normal\n# comment\n400 2 normal\n")
+    with pytest.raises(ValueError, match=r'chart\.txt:4:'):
+        list(rg.iter_text_chart(path))
+
+
+@pytest.mark.parametrize('records', [
+    [(0, 0, 0, 0), (10, 4, 0, 0)],  # Track out of range
+    [(0, 0, 0, 0), (10, 0, 3, 0)],  # Unknown note type
+    [(10, 0, 0, 0), (5, 0, 0, 0)],  # Time goes backwards
+])
+def test_binary_chart_rejects_bad_records(tmp_path, records):
+    path = tmp_path / 'chart.rgc'
+    write_records(path, records)
+    with pytest.raises(ValueError, match='record 1'):
+        list(rg.iter_binary_chart(path))
+    with pytest.raises(ValueError, match='record 1'):
+        list(rg.MappedChart(path).iter_from(0))
+
+
+@pytest.mark.parametrize('note', [
+    rg.ChartNote(0.0, 0, 'hold', 65.536),
+    rg.ChartNote(-0.001, 0, 'normal', 0.0),
+    rg.ChartNote(2 ** 32 / 1000, 0, 'normal', 0.0),
+    rg.ChartNote(0.0, rg.TRACK_COUNT, 'normal', 0.0),
+])
+def test_write_chart_rejects_out_of_range_notes(tmp_path, note):
+    with pytest.raises(ValueError, match='note 0'):
+        rg.write_chart(tmp_path / 'chart.rgc', [note])
+
+
+def bisect_left_ms(times_ms, seconds):
+    return next((i for i, ms in enumerate(times_ms) if ms >= seconds * 1000), len(times_ms))
+
+
+def test_mapped_chart_seek_at_second_boundaries(tmp_path):
+    # Notes on, just before and just after second boundaries, with empty seconds in between
+    times_ms = [0, 999, 1000, 1000, 1001, 2999, 3000, 7000, 7500, 9999]
+    path = tmp_path / 'chart.rgc'
+    rg.write_chart(path, [rg.ChartNote(ms / 1000, 0, 'normal', 0.0) for ms in times_ms])
+    chart = rg.MappedChart(path)
+    assert len(chart) == len(times_ms)
+    assert chart.index.tolist() == [0, 2, 5, 6, 7, 7, 7, 7, 9, 9]
+    for seconds in [-1.0, 0.0, 0.0005, 0.999, 1.0, 1.0005, 1.001, 2.0, 3.0, 4.5, 7.0, 7.2, 9.999, 10.0, 50.0]:
+        expected = bisect_left_ms(times_ms, seconds)
+        assert chart.seek(seconds) == expected, seconds
+        assert [note.time for note in chart.iter_from(seconds)] == [ms / 1000 for ms in times_ms[expected:]]
+
+
+def test_iter_chart_without_index_matches_mapped(tmp_path):
+    path = tmp_path / 'chart.rgc'
+    rg.write_chart(path, sample_notes())
+    for seconds in [0.0, 1.0, 2.6]:
+        assert list(rg.MappedChart(path).iter_from(seconds)) == [
+            note for note in rg.iter_binary_chart(path) if note.time >= seconds]
@@ -0,0 +1,65 @@
+import pytest
+
+import rhythm_game as rg
+
+
+@pytest.fixture
+def chart(tmp_path, monkeypatch):
+    # Replays store the chart path as given, relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    rg.write_chart('chart.rgc', [rg.ChartNote(i * 0.25, i % rg.TRACK_COUNT, 'normal', 0.0) for i in range(4 * 3600)])
+    return 'chart.rgc'
+
+
+def record_session(chart_path, chart_start, frames=600):
+    """Autoplay a recorded headless session, pressing most notes on time; returns (replay path, result)"""
+    clock = rg.SimulatedClock()
+    game = rg.RhythmGame(time_source=clock, headless=True, chart_path=chart_path, chart_start=chart_start,
+                         replay_dir='replays', settings=dict(rg.DEFAULT_SETTINGS))
+    pressed = set()
+    for frame in range(frames):
+        clock.advance(1 / 60)
+        now = game.game_time_at(clock())
+        for track in range(rg.TRACK_COUNT):
+            note = game.notes.nearest(track, now)
+            if note is not None and note.hit_time <= now and frame % 5 and (track, note.hit_time) not in pressed:
+                pressed.add((track, note.hit_time))
+                game.press(game.key_mappings[track], now)
+        game.update()
+    result = game.replay_result()
+    return game.save_replay(), result
+
+
+@pytest.mark.parametrize('chart_start', [0.0, 2400.0, 3500.0])
+def test_recorded_session_verifies(chart, chart_start):
+    path, result = record_session(chart, chart_start)
+    assert result['score'] > 0
+    replay = rg.load_replay(path)
+    assert replay['chart_start'] == chart_start
+    assert replay['records'][0][1] >= chart_start - 5  # Deltas start from the session's start time
+    assert rg.verify_replay(path) == (True, result)
+
+
+def test_replay_rejects_changed_chart(chart):
+    path, _ = record_session(chart, 0.0, frames=120)
+    with open(chart, 'ab') as f:
+        f.write(b'\0')
+    with pytest.raises(ValueError, match='does not match'):
+        rg.verify_replay(path)
+
+
+def test_replay_rejects_damaged_files(chart, tmp_path):
+    path, _ = record_session(chart, 0.0, frames=120)
+    data = open(path, 'rb').read()
+    header = list(rg.REPLAY_HEADER.unpack_from(data))
+    header[4] = 0  # Height
+    damaged = {
+        'truncated header': data[:14],
+        'invalid resolution': rg.REPLAY_HEADER.pack(*header) + data[rg.REPLAY_HEADER.size:],
+        'record log': data[:-10],
+    }
+    for reason, contents in damaged.items():
+        damaged_path = tmp_path / 'damaged.rgr'
+        damaged_path.write_bytes(contents)
+        with pytest.raises(ValueError, match=reason):
+            rg.load_replay(damaged_path)
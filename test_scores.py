@@ -0,0 +1,60 @@
+import json
+import threading
+
+import pytest
+
+import rhythm_game as rg
+
+
+LEGACY = [
+    {'name': 'AAA', 'score': 900, 'difficulty': 'hard', 'max_combo': 40, 'accuracy': 91.0, 'date': '2024-01-02 10:00'},
+    {'name': 'BBB', 'score': 700, 'difficulty': 'normal', 'max_combo': 25, 'accuracy': 80.5, 'date': '2024-01-03 11:00'},
+    {'name': 'CCC', 'score': 300, 'difficulty': 'normal', 'max_combo': 9, 'accuracy': 60.0, 'date': '2024-01-04 12:00'},
+]
+
+
+@pytest.fixture
+def paths(tmp_path):
+    legacy_path = tmp_path / 'high_scores.json'
+    legacy_path.write_text(json.dumps(LEGACY))
+    return str(tmp_path / 'scores.db'), str(legacy_path)
+
+
+def test_legacy_scores_are_imported_once(paths):
+    store = rg.ScoreStore(*paths)
+    assert store.count() == len(LEGACY)
+    store.add('DDD', 500, 'normal', 12, 70.0)
+    store.close()
+
+    store = rg.ScoreStore(*paths)
+    assert store.count() == len(LEGACY) + 1
+    store.close()
+
+
+def test_top_per_difficulty(paths):
+    store = rg.ScoreStore(*paths)
+    store.add_many([dict(LEGACY[1], name='EEE', score=1000, difficulty='expert'),
+                    dict(LEGACY[1], name='FFF', score=500)])
+    assert [entry['name'] for entry in store.top()] == ['EEE', 'AAA', 'BBB', 'FFF', 'CCC']
+    assert [entry['name'] for entry in store.top(2, 'normal')] == ['BBB', 'FFF']
+    assert store.top(5, 'hard') == [LEGACY[0]]
+    assert store.top(5, 'master') == []
+    store.close()
+
+
+def test_shared_store_works_from_any_thread(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(rg, '_score_store', None)
+    assert rg.load_high_scores() == []
+
+    def save(thread):
+        for i in range(20):
+            rg.save_high_score(f"T{thread}", thread * 100 + i, 'normal', 1, 50.0)
+    threads = [threading.Thread(target=save, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert rg.get_score_store().count() == 80
+    assert rg.load_high_scores()[0]['score'] == 319
+    rg.get_score_store().close()